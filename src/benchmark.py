@@ -0,0 +1,196 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+import loads
+import scriptutils
+from dc.dc import DCEnv
+
+parser = argparse.ArgumentParser(description="Simulator throughput benchmark, runs DCEnv with scripted policies without ray")
+parser.add_argument("--n_servers", nargs="+", type=int, default=[40, 360])
+parser.add_argument("--n_racks", nargs="+", type=int, default=[1, 12])
+parser.add_argument("--n_crah", nargs="+", type=int, default=[1, 4])
+parser.add_argument("--arrival_rate", nargs="+", type=float, default=[0, 10]) # 0 is one job per step as in main.py
+parser.add_argument("--policy", nargs="+", default=["least_loaded", "random"])
+parser.add_argument("--backend", nargs="+", default=["numpy"])
+parser.add_argument("--avg_load", type=float, default=200)
+parser.add_argument("--placement_index", action="store_true") # Place through dc.placement.PlacementIndex instead of scanning the load
+parser.add_argument("--steps", type=int, default=2000)
+parser.add_argument("--memory_steps", type=int, default=200) # Separate traced run for peak memory, tracing slows down the timing
+parser.add_argument("--output", type=str, default=None) # Append results as json lines
+parser.add_argument("--check_imports", action="store_true") # Only measure the imports, fails if the simulation pulls in an ML framework
+args = parser.parse_args()
+
+# The simulation has to stay importable with numpy and gym only, rllib workers import it on startup
+IMPORTS = ["loads", "dc.dc", "dc.vecdc", "dc.metrics", "dc.recorder"]
+HEAVY_MODULES = ["tensorflow", "torch", "pandas", "ray", "numba", "matplotlib"]
+
+def import_cost():
+    """
+    Import time and max RSS of a fresh interpreter importing the simulation, and the heavy modules it pulled in
+    """
+    code = "\n".join([
+        "import json, resource, sys, time",
+        "start = time.perf_counter()",
+        *[f"import {module}" for module in IMPORTS],
+        "print(json.dumps({",
+        "    'import_time': time.perf_counter() - start,",
+        "    'import_max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,",
+        f"    'heavy_modules': [m for m in {HEAVY_MODULES!r} if m in sys.modules],",
+        "}))",
+    ])
+    src = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=src)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def policy_actions(policy, env):
+    """
+    Scripted action for the policy, the action list of the env is chosen to match it
+    """
+    if policy == "least_loaded":
+        return ["none"], lambda rng: (0,)
+    elif policy == "random":
+        return ["server", "crah_out", "crah_flow"], lambda rng: (rng.integers(env["n_servers"]), rng.uniform(-1, 1, 1), rng.uniform(-1, 1, 1))
+    elif policy == "rack":
+        return ["rack", "crah_out", "crah_flow"], lambda rng: (rng.integers(env["n_racks"]), np.zeros(1), np.zeros(1))
+    elif policy == "rack_slot":
+        return ["rack", "slot"], lambda rng: (rng.integers(env["n_racks"]), rng.integers(env["n_servers"] // env["n_racks"]))
+    raise ValueError(f"Unknown policy {policy}")
+
+def make_config(n_servers, n_racks, n_crah, arrival_rate, backend):
+    return {
+        "n_servers": n_servers,
+        "n_racks": n_racks,
+        "n_crah": n_crah,
+        "load_generator": scriptutils.load_generator(args.avg_load, n_servers, arrival_rate, seed=0),
+        "ambient_temp": loads.SinusTemperature(offset=20, amplitude=5),
+        "backend": backend,
+        "placement_index": args.placement_index,
+    }
+
+def add_profile(totals, summary, kind):
+    """
+    Sum the prof/<phase>_<kind> entries of a profiler summary into totals by phase
+    """
+    for key, value in summary.items():
+        if key.startswith("prof/") and key.endswith("_" + kind):
+            phase = key[len("prof/"):-len(kind) - 1]
+            totals[phase] = totals.get(phase, 0) + value
+
+def callbacks_step():
+    """
+    LoggingCallbacks.on_episode_step/on_episode_end driven with stand ins for the rllib objects, None if ray is missing
+    """
+    try:
+        from loggerutils.loggingcallbacks import LoggingCallbacks
+    except ImportError:
+        return None
+    callbacks = LoggingCallbacks()
+    def step(env, end):
+        base_env = SimpleNamespace(get_unwrapped=lambda: [env])
+        episode = SimpleNamespace(custom_metrics={})
+        callbacks.on_episode_step(worker=None, base_env=base_env, episode=episode, env_index=0)
+        if end:
+            callbacks.on_episode_end(worker=None, base_env=base_env, policies={}, episode=episode, env_index=0)
+        return episode.custom_metrics
+    return step
+
+def run(config, actions, policy_action, steps, profile=None, callbacks=None):
+    """
+    Run steps with the policy, profile collects the dc.profiler summaries ({"time": {phase: seconds}, ...})
+    """
+    env = DCEnv(dict(config, actions=actions, profile=profile is not None, profile_memory=profile is not None and "peak_bytes" in profile))
+    rng = np.random.default_rng(0)
+    env.reset()
+    callback_time = 0.0
+    start = time.perf_counter()
+    for i in range(steps):
+        env.step(policy_action(rng))
+        if callbacks is not None:
+            callback_start = time.perf_counter()
+            custom_metrics = callbacks(env, (i + 1) % 100 == 0) # Same horizon as main.py
+            callback_time += time.perf_counter() - callback_start
+            # The episode end callback takes the profiler summary
+            for kind, totals in (profile or {}).items():
+                add_profile(totals, custom_metrics, kind)
+    elapsed = time.perf_counter() - start
+    if profile is not None:
+        summary = env.profiler.summary()
+        for kind, totals in profile.items():
+            add_profile(totals, summary, kind)
+    env.close()
+    return elapsed, callback_time
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+imports = import_cost()
+print(f"import {imports['import_time']:.3f} s, max rss {imports['import_max_rss_kb'] / 1024:.1f} MB, heavy modules {imports['heavy_modules']}")
+if args.check_imports:
+    sys.exit(1 if imports["heavy_modules"] else 0)
+
+callbacks = callbacks_step()
+commit = git_commit()
+grid = itertools.product(args.n_servers, args.n_racks, args.n_crah, args.arrival_rate, args.policy, args.backend)
+for n_servers, n_racks, n_crah, arrival_rate, policy, backend in grid:
+    if n_servers % n_racks != 0:
+        continue
+    config = make_config(n_servers, n_racks, n_crah, arrival_rate, backend)
+    actions, policy_action = policy_actions(policy, config)
+
+    # Plain run for throughput, then profiled and memory traced runs
+    run(config, actions, policy_action, 10) # Warm up, compiles the numba kernel
+    total_time, _ = run(config, actions, policy_action, args.steps)
+    timings = {}
+    profiled_time, callback_time = run(config, actions, policy_action, args.steps, {"time": timings}, callbacks)
+    tracemalloc.start()
+    run(config, actions, policy_action, args.memory_steps)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Per phase peaks in a run of their own, the profiler resets the tracemalloc peak for every phase
+    tracemalloc.start()
+    peaks = {}
+    run(config, actions, policy_action, args.memory_steps, {"peak_bytes": peaks})
+    tracemalloc.stop()
+
+    # step and tick contain the other phases, update_jobs runs inside servers.update unless the numba kernel
+    # replaces the update
+    nested = {"step", "tick"} | ({"servers.update_jobs"} if backend == "numpy" else set())
+    result = {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "n_servers": n_servers,
+        "n_racks": n_racks,
+        "n_crah": n_crah,
+        "arrival_rate": arrival_rate,
+        "policy": policy,
+        "backend": backend,
+        "placement_index": args.placement_index,
+        "steps": args.steps,
+        "steps_per_sec": args.steps / total_time,
+        "component_time_per_step": {name: t / args.steps for name, t in timings.items()},
+        "callbacks_time_per_step": None if callbacks is None else callback_time / args.steps,
+        "other_time_per_step": (profiled_time - callback_time - sum(t for name, t in timings.items() if name not in nested)) / args.steps,
+        "peak_traced_memory": peak_memory,
+        "component_peak_memory": peaks,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **imports,
+    }
+    print(f"{n_servers:6d} servers {n_racks:3d} racks {n_crah:2d} crah rate {arrival_rate:6.1f} {policy:>12s} {backend:>6s}: {result['steps_per_sec']:9.1f} steps/s")
+    if args.output is not None:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
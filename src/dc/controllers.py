@@ -0,0 +1,121 @@
+import numpy as np
+
+# Time series recorded per env and step by run_controllers
+SERIES = ["energy", "dropped_jobs", "overheated_inlets"]
+
+class Controller:
+    """
+    Scripted controller for a VecDCEnv. A controller acts on a set of rows (envs) of the batch, act returns
+    their actions in env units as a dict of arrays with one row per env in rows. Anything left out takes the
+    env defaults, a negative "server" places with least_loaded.
+    """
+    def reset(self, env, rows):
+        pass
+
+    def act(self, env, rows):
+        return {}
+
+class FixedSetpoints(Controller):
+    """
+    Constant CRAH setpoints and least loaded placement, what DCEnv does during pretraining
+    """
+    def __init__(self, crah_out=22, crah_flow=0.8):
+        self.crah_out = crah_out
+        self.crah_flow = crah_flow # Fraction of the max CRAH flow
+
+    def act(self, env, rows):
+        return {
+            "crah_out": np.full((len(rows), 1), self.crah_out, dtype=float),
+            "crah_flow": np.full((len(rows), 1), self.crah_flow * env.crah.max_flow),
+        }
+
+class PIDCrah(FixedSetpoints):
+    """
+    PID on the CRAH outlet temperature, lowers the setpoint when the hottest server inlet is above target.
+    The integral stops while the setpoint is saturated.
+    """
+    def __init__(self, target=25, kp=0.5, ki=0.01, kd=0.0, crah_out=22, crah_flow=0.8):
+        super().__init__(crah_out, crah_flow)
+        self.target = target
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+
+    def reset(self, env, rows):
+        self.integral = np.zeros(len(rows))
+        self.prev_error = np.zeros(len(rows))
+
+    def act(self, env, rows):
+        error = np.max(env.flowsim.server_temp_in[rows], axis=-1) - self.target
+        integral = self.integral + error * env.dt
+        derivative = (error - self.prev_error) / env.dt
+        self.prev_error = error
+
+        setpoint = self.crah_out - (self.kp * error + self.ki * integral + self.kd * derivative)
+        saturated = (setpoint < env.crah.min_temp) | (setpoint > env.crah.max_temp)
+        self.integral = np.where(saturated, self.integral, integral)
+
+        action = super().act(env, rows)
+        action["crah_out"] = np.clip(setpoint, env.crah.min_temp, env.crah.max_temp)[:, None]
+        return action
+
+class ThresholdPlacement(FixedSetpoints):
+    """
+    Places on the lowest indexed server below threshold times the max load, the least loaded one if none is
+    """
+    def __init__(self, threshold=0.8, crah_out=22, crah_flow=0.8):
+        super().__init__(crah_out, crah_flow)
+        self.threshold = threshold
+
+    def act(self, env, rows):
+        load = env.servers.load[rows]
+        below = load <= self.threshold * env.servers.max_load
+        action = super().act(env, rows)
+        action["server"] = np.where(np.any(below, axis=-1), np.argmax(below, axis=-1), np.argmin(load, axis=-1))[:, None]
+        return action
+
+# Names for the command line, see evaluate.py
+CONTROLLERS = {
+    "fixed": FixedSetpoints,
+    "pid": PIDCrah,
+    "threshold": ThresholdPlacement,
+}
+
+def run_controllers(env, controllers, steps):
+    """
+    Run a VecDCEnv in lock-step for steps with controllers[i] acting on env i, the same controller object can
+    run several envs. Returns a dict of (num_envs, steps) arrays with the SERIES of every env.
+    """
+    groups = {}
+    for i, controller in enumerate(controllers):
+        groups.setdefault(id(controller), (controller, []))[1].append(i)
+    groups = [(controller, np.array(rows)) for controller, rows in groups.values()]
+
+    series = {name: np.zeros((env.num_envs, steps)) for name in SERIES}
+    env.vector_reset()
+    for controller, rows in groups:
+        controller.reset(env, rows)
+    for step in range(steps):
+        actions = [(controller.act(env, rows), rows) for controller, rows in groups]
+        env.vector_step_env(merge_actions(actions, env))
+        # Costs divided by their factors are the physical totals of the step
+        series["energy"][:, step] = env.total_energy_cost / env.energy_cost
+        series["dropped_jobs"][:, step] = env.total_job_drop_cost / env.job_drop_cost
+        series["overheated_inlets"][:, step] = env.total_overheat_cost / env.overheat_cost
+    return series
+
+def merge_actions(actions, env):
+    """
+    One action dict for the batch from (action, rows) per controller, rows without an entry get the defaults
+    """
+    defaults = {"server": -1, "crah_out": env.crah_out_setpoint, "crah_flow": env.crah_flow_setpoint * env.crah.max_flow}
+    names = {name for action, _ in actions for name in action}
+    merged = {}
+    for name in names:
+        assert name in defaults, f"Controllers can't set {name}"
+        width = max(np.shape(action[name])[-1] for action, _ in actions if name in action)
+        merged[name] = np.full((env.num_envs, width), defaults[name], dtype=np.int64 if name == "server" else float)
+        for action, rows in actions:
+            if name in action:
+                merged[name][rows] = action[name]
+    return merged
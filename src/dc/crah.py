@@ -1,10 +1,27 @@
 import numpy as np
 
-class CRAH:
-    def __init__(self, n_crah, air_vol_heatcap):
+from dc.kernel import fan_power
+from dc.state import StateBuffer
+
+class CRAH(StateBuffer):
+    __slots__ = ["n_crah", "air_vol_heatcap", "n_envs", "shape", "min_temp", "max_temp", "min_flow", "max_flow", "max_fan_power"]
+    # State kept in the buffer and saved by DCEnv.get_state_snapshot
+    state_attributes = ["flow", "temp_out", "fan_power", "compressor_power"]
+
+    def __init__(self, n_crah, air_vol_heatcap, n_envs=None, dtype=np.float64):
         self.n_crah = n_crah
         self.air_vol_heatcap = air_vol_heatcap
 
+        # With n_envs set every array gets a leading env dimension, one row per datacenter
+        self.n_envs = n_envs
+        self.shape = (n_crah,) if n_envs is None else (n_envs, n_crah)
+        self.allocate({
+            "flow": (dtype, self.shape),
+            "temp_out": (dtype, self.shape),
+            "fan_power": (dtype, self.shape[:-1]),
+            "compressor_power": (dtype, self.shape[:-1]),
+        })
+
         self.min_temp = 18
         self.max_temp = 27
         self.min_flow = 0.1 # To avoid divide by zero
@@ -15,20 +32,36 @@ class CRAH:
         self.max_fan_power = 2646 / 2
 
     def reset(self, ambient_temp):
-        self.flow = self.min_flow * np.ones(self.n_crah)
-        self.temp_out = 22 * np.ones(self.n_crah)
+        self.flow = self.min_flow
+        self.temp_out = 22
 
-        self.fan_power = np.sum(self.max_fan_power * (self.flow / self.max_flow)**3)
+        self.fan_power = fan_power(self.flow, self.max_flow, self.max_fan_power)
 
         # If Tamb < Tout compressor is off
-        self.compressor_power = np.sum((ambient_temp > self.temp_out) * self.air_vol_heatcap * self.flow * (ambient_temp - self.temp_out))
+        self.compressor_power = np.sum((ambient_temp > self.temp_out) * self.air_vol_heatcap * self.flow * (ambient_temp - self.temp_out), axis=-1)
+
+    def reset_at(self, index, ambient_temp):
+        """
+        Reset a single datacenter (row index) when running batched
+        """
+        self.flow[index] = self.min_flow
+        self.temp_out[index] = 22
+
+        self.fan_power = fan_power(self.flow, self.max_flow, self.max_fan_power)
+        self.compressor_power[index] = np.sum((ambient_temp > self.temp_out[index]) * self.air_vol_heatcap * self.flow[index] * (ambient_temp - self.temp_out[index]))
 
     def update(self, temp_out, flow, temp_in, ambient_temp):
-        # Maybe allow individual control?
-        self.flow = flow * np.ones(self.n_crah)
-        self.temp_out = temp_out * np.ones(self.n_crah)
+        # Setpoints are either shared or one per CRAH, assigning broadcasts them into the state buffer
+        self.flow = flow
+        self.temp_out = temp_out
+
+        self.fan_power = fan_power(self.flow, self.max_flow, self.max_fan_power)
 
-        self.fan_power = np.sum(self.max_fan_power * (self.flow / self.max_flow)**3)
+        self.compressor_power = self.compressor(temp_in, ambient_temp)
 
+    def compressor(self, temp_in, ambient_temp):
+        """
+        Compressor power at the current flow and setpoint, ambient_temp can have extra leading dimensions
+        """
         # If Tamb < Tout compressor is off
-        self.compressor_power = np.sum((ambient_temp > self.temp_out) * self.air_vol_heatcap * self.flow * (temp_in - self.temp_out))
\ No newline at end of file
+        return np.sum((ambient_temp > self.temp_out) * self.air_vol_heatcap * self.flow * (temp_in - self.temp_out), axis=-1)
\ No newline at end of file
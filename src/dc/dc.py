@@ -1,19 +1,32 @@
-import tensorflow as tf
-from tensorflow.keras.layers import Dense, Flatten
-from tensorflow.keras import Model, Input
-
-import pandas as pd
+import copy
+import itertools
+import json
 import os
-import heapq
+import warnings
+
 import numpy as np
 import gym
-import time
 
 from dc.simpleflow import SimpleFlow
-from dc.servers import Servers
+from dc.spatialflow import SpatialFlow
+from dc.servers import Servers, least_loaded
+from dc.jobs import JobQueue
 from dc.crah import CRAH
+from dc import kernel
+from dc.metrics import MetricsRecorder, AsyncMetricsRecorder
+from dc.recorder import TrajectoryRecorder
+from dc.schedule import PrefetchedArrival, PrefetchedTemperature
+from dc.profiler import Profiler
+from dc.placement import PlacementIndex
+from dc.observations import rack_histogram, rack_quantiles
+
+# Numbers the envs of a process, rllib workers can hold several envs that each write their own files
+_env_ids = itertools.count()
 
 class DCEnv(gym.Env):
+    # State saved by get_state_snapshot besides the parts, jobs and random generators
+    state_attributes = ["time", "total_energy_cost", "total_job_drop_cost", "total_overheat_cost", "job_state"]
+
     def __init__(self, config={}):
         self.dt = config.get("dt", 1)
         self.seed = config.get("seed", 37)
@@ -24,12 +37,49 @@ class DCEnv(gym.Env):
         self.crah_out_setpoint = config.get("crah_out_setpoint", 22)
         self.crah_flow_setpoint = config.get("crah_flow_setpoint", 0.8)
 
-        self.flowsim = SimpleFlow(self.dt, config.get("n_servers", 360), config.get("n_racks", 12), config.get("n_crah", 4))
+        # The agent acts every control_interval seconds while the physics runs at dt in between
+        control_interval = config.get("control_interval", self.dt)
+        self.substeps = int(round(control_interval / self.dt))
+        if self.substeps < 1 or not np.isclose(self.substeps * self.dt, control_interval):
+            raise ValueError(f"control_interval {control_interval} is not a positive multiple of dt {self.dt}")
+        # Skip the physics for ticks without arrivals or completions once the state has settled, jumping straight
+        # to the next arrival, completion or end of the control interval
+        self.fast_forward = config.get("fast_forward", False)
+        self.steady_tol = config.get("steady_tol", 1e-6)
+
+        # "numba" runs the physics of a tick as one compiled in place kernel, same results as "numpy"
+        self.backend = config.get("backend", "numpy")
+        if self.backend == "numba" and not kernel.available:
+            warnings.warn("numba is not installed, using the numpy backend")
+            self.backend = "numpy"
+
+        # "simple" mixes all air in one volume, "spatial" recirculates per CRAH zone and between neighbouring servers
+        self.flow_model = config.get("flow_model", "simple")
+        self.flow_config = config.get("flow", {}) # Extra SpatialFlow arguments
+        if self.backend == "numba" and self.flow_model != "simple":
+            warnings.warn("The numba kernel only implements the simple flow model, using the numpy backend")
+            self.backend = "numpy"
+        # Precision of the thermal state, float32 halves its memory but results drift from the float64 default
+        self.state_dtype = np.dtype(config.get("state_dtype", "float64"))
+        if self.backend == "numba" and self.state_dtype != np.float64:
+            # The kernel sums and keeps intermediates in float64, so it would not match numpy on float32 state
+            warnings.warn(f"The numba kernel only matches the numpy backend for float64 state, using the numpy backend for {self.state_dtype}")
+            self.backend = "numpy"
+        self.flowsim = self.make_flowsim(config.get("n_servers", 360), config.get("n_racks", 12), config.get("n_crah", 4))
 
         self.n_servers = self.flowsim.n_servers
         self.n_crah = self.flowsim.n_crah
 
-        self.n_place = config.get("n_place", self.n_servers)
+        # Jobs only go to the first n_place servers, more than there are means all of them
+        self.n_place = min(config.get("n_place", self.n_servers), self.n_servers)
+
+        # Placement without a server action, "least_loaded" spreads jobs and "first_fit" packs them onto the lowest
+        # servers with room. placement_index keeps per rack minimum loads so placing stays cheap for large fleets.
+        self.placement = config.get("placement", "least_loaded")
+        assert self.placement in ("least_loaded", "first_fit"), f"Unknown placement {self.placement}"
+        self.placement_index = config.get("placement_index", False) or self.placement == "first_fit"
+        if self.placement_index and self.n_place < self.n_servers:
+            raise ValueError(f"The placement index covers all servers, n_place {self.n_place} < n_servers {self.n_servers} is not supported")
 
         nu = 1.568e-5 # Kinematic viscosity of air (m^2/s)
         k = 2.624e-2 # Thermal conductivity (W/m K)
@@ -37,8 +87,8 @@ class DCEnv(gym.Env):
         air_vol_heatcap = Pr * k / nu 
         R = config.get("kR", 3) / air_vol_heatcap
 
-        self.servers = Servers(self.n_servers, air_vol_heatcap, R)
-        self.crah = CRAH(self.n_crah, air_vol_heatcap)
+        self.servers = Servers(self.n_servers, air_vol_heatcap, R, dtype=self.state_dtype)
+        self.crah = CRAH(self.n_crah, air_vol_heatcap, dtype=self.state_dtype)
 
         # Jobs
         self.load_generator = config["load_generator"]
@@ -46,45 +96,81 @@ class DCEnv(gym.Env):
         self.actions = config.get("actions", ["server", "crah_out", "crah_flow"])
         self.observations = config.get("observations", ["temp_out", "load", "job"])
 
+        # Size independent observations for large fleets, "rack_load" is a histogram of the server load per rack,
+        # "rack_temp" quantiles of the outlet temperature per rack and "candidates" the load and outlet temperature
+        # of the n_candidates least loaded servers. The "candidate" action places on one of those.
+        self.load_bins = config.get("load_bins", 4)
+        self.temp_quantiles = np.linspace(0, 1, config.get("temp_quantiles", 5))
+        self.n_candidates = config.get("n_candidates", 8)
+        self.use_candidates = "candidates" in self.observations or "candidate" in self.actions
+        self.candidates = None
+        # The index keeps the rack histograms and candidates up to date as jobs start and finish
+        if self.placement_index or ((self.use_candidates or "rack_load" in self.observations) and self.n_place == self.n_servers):
+            bins = self.load_bins if "rack_load" in self.observations else 0
+            self.servers.index = PlacementIndex(self.n_servers, self.flowsim.servers_per_rack, bins, (self.servers.idle_load, self.servers.max_load))
+
         # Ambient temp
         self.ambient_temp = config["ambient_temp"]
 
+        # Jobs and ambient temp are evaluated prefetch steps at a time and then read by index, 0 calls them every step
+        self.prefetch = config.get("prefetch", 10000)
+        self.ambient_temp = PrefetchedTemperature(self.ambient_temp, self.dt, self.prefetch)
+        self.arrivals = PrefetchedArrival(self.load_generator, self.dt, self.prefetch)
+
+        # One setpoint for all CRAH units, or one per unit. The simple flow model only feeds the air of the first
+        # unit to the servers while the compressor counts all of them, so that needs the spatial flow model
+        # (which also keeps it away from the numba kernel).
+        self.individual_crah = config.get("individual_crah", False)
+        if self.individual_crah and self.flow_model != "spatial":
+            raise ValueError(f"individual_crah needs the spatial flow model, not {self.flow_model}")
+        n_crah_actions = self.n_crah if self.individual_crah else 1
+
         # Gym environment stuff
         # Generate all individual action spaces
         action_spaces_agent = {
             "none": gym.spaces.Discrete(2), # If running with other algorithms
             "rack": gym.spaces.Discrete(self.flowsim.n_racks), 
             "server": gym.spaces.Discrete(self.flowsim.n_servers), 
-            "crah_out": gym.spaces.Box(-1.0, 1.0, shape=(1,)),
-            "crah_flow": gym.spaces.Box(-1.0, 1.0, shape=(1,)),
+            "slot": gym.spaces.Discrete(self.flowsim.servers_per_rack), # Server within the chosen rack
+            "candidate": gym.spaces.Discrete(self.n_candidates), # One of the "candidates" observation
+            "crah_out": gym.spaces.Box(-1.0, 1.0, shape=(n_crah_actions,)),
+            "crah_flow": gym.spaces.Box(-1.0, 1.0, shape=(n_crah_actions,)),
         }
         action_spaces_env = {
             "none": gym.spaces.Discrete(2),
             "rack": gym.spaces.Discrete(self.flowsim.n_racks), 
             "server": gym.spaces.Discrete(self.flowsim.n_servers), 
-            "crah_out": gym.spaces.Box(self.crah.min_temp, self.crah.max_temp, shape=(1,)),
-            "crah_flow": gym.spaces.Box(self.crah.min_flow, self.crah.max_flow, shape=(1,)),
+            "slot": gym.spaces.Discrete(self.flowsim.servers_per_rack),
+            "candidate": gym.spaces.Discrete(self.n_candidates),
+            "crah_out": gym.spaces.Box(self.crah.min_temp, self.crah.max_temp, shape=(n_crah_actions,)),
+            "crah_flow": gym.spaces.Box(self.crah.min_flow, self.crah.max_flow, shape=(n_crah_actions,)),
         }
+        # "rack" then "slot" picks a server with n_racks + servers_per_rack choices instead of n_servers
+        assert "slot" not in self.actions or "rack" in self.actions, "The slot action needs the rack action"
         # Put it together based on chosen actions
         self.action_space = gym.spaces.Tuple(tuple(map(action_spaces_agent.__getitem__, self.actions)))
         self.action_space_env = gym.spaces.Tuple(tuple(map(action_spaces_env.__getitem__, self.actions)))
 
         # All individual observation spaces
-        observation_spaces = {
-            "load": gym.spaces.Box(-100.0, 100.0, shape=(self.n_servers,)),
-            "temp_out": gym.spaces.Box(-100.0, 100.0, shape=(self.n_servers,)),
-            "job": gym.spaces.Box(-100.0, 100.0, shape=(2,)),
-        }
-        observation_spaces_target = {
-            "load": gym.spaces.Box(-1.0, 1.0, shape=(self.n_servers,)),
-            "temp_out": gym.spaces.Box(-1.0, 1.0, shape=(self.n_servers,)),
-            "job": gym.spaces.Box(-1.0, 1.0, shape=(2,)),
+        sizes = {
+            "load": self.n_servers,
+            "temp_out": self.n_servers,
+            "job": 2,
+            "rack_load": self.flowsim.n_racks * self.load_bins,
+            "rack_temp": self.flowsim.n_racks * len(self.temp_quantiles),
+            "candidates": 2 * self.n_candidates,
         }
+        observation_spaces = {name: gym.spaces.Box(-100.0, 100.0, shape=(size,)) for name, size in sizes.items()}
+        observation_spaces_target = {name: gym.spaces.Box(-1.0, 1.0, shape=(size,)) for name, size in sizes.items()}
         observation_spaces_env = {
             "load": gym.spaces.Box(self.servers.idle_load, self.servers.max_load, shape=(self.n_servers,)),
             #"temp_out": gym.spaces.Box(-10, self.servers.max_temp_cpu+10, shape=(self.n_servers,)),
             "temp_out": gym.spaces.Box(15, 85, shape=(self.n_servers,)),
             "job": gym.spaces.Box(np.array(self.load_generator.min_values()), np.array(self.load_generator.max_values())),
+            "rack_load": gym.spaces.Box(0, 1, shape=(sizes["rack_load"],)), # Fraction of the rack per bin
+            "rack_temp": gym.spaces.Box(15, 85, shape=(sizes["rack_temp"],)),
+            # Loads then outlet temperatures
+            "candidates": gym.spaces.Box(np.repeat([self.servers.idle_load, 15.0], self.n_candidates), np.repeat([self.servers.max_load, 85.0], self.n_candidates)),
         }
         # Put it together based on chosed observations
         # The real space is just made bigger than the target to fit anything that falls outside, only needed for ray to be happy
@@ -93,7 +179,64 @@ class DCEnv(gym.Env):
         self.observation_space_target = gym.spaces.Tuple(tuple(map(observation_spaces_target.__getitem__, self.observations)))
         # The source space is what we approximate the values to be within in the environment
         self.observation_space_env = gym.spaces.Tuple(tuple(map(observation_spaces_env.__getitem__, self.observations)))
-        
+
+        # Optionally give the agent one flat Box instead of the tuple, rllib flattens it anyway
+        self.flatten_observations = config.get("flatten_observations", False)
+        if self.flatten_observations:
+            size = sum(space.shape[0] for space in self.observation_space)
+            self.observation_space = gym.spaces.Box(-100.0, 100.0, shape=(size,))
+
+        # Linear maps env -> target for observations and clipped agent -> env for Box actions, computed once here
+        # so get_state and step only do in place multiply adds. Discrete actions have no map and pass through.
+        self.observation_maps = [self.affine_map(space, target) for space, target in zip(self.observation_space_env, self.observation_space_target)]
+        self.action_maps = [self.affine_map(space, space_env) if isinstance(space, gym.spaces.Box) else None for space, space_env in zip(self.action_space, self.action_space_env)]
+        # Names the metrics chunks and the trajectory directory of this env together with the pid
+        self.env_id = next(_env_ids)
+        # Signals recorded into ring buffers for logging, see dc.metrics, with "async" they are evaluated on a background thread
+        self.metrics_config = config.get("metrics", {})
+        # Full state streamed to memory mapped files, one directory per env named pid_envid
+        self.recorder = None
+        if config.get("record_path") is not None:
+            self.recorder = TrajectoryRecorder(os.path.join(config["record_path"], f"{os.getpid()}_{self.env_id}"), **config.get("record", {}))
+        # Time spent per phase, see dc.profiler, costs nothing when off. "profile_memory" also traces allocations
+        self.profiler = Profiler(config.get("profile_memory", False)) if config.get("profile", False) else None
+        self.allocate_buffers(())
+
+    def make_flowsim(self, n_servers, n_racks, n_crah, n_envs=None):
+        if self.flow_model == "spatial":
+            return SpatialFlow(self.dt, n_servers, n_racks, n_crah, n_envs=n_envs, dtype=self.state_dtype, **self.flow_config)
+        return SimpleFlow(self.dt, n_servers, n_racks, n_crah, n_envs=n_envs, dtype=self.state_dtype)
+
+    def affine_map(self, source, target):
+        """
+        Return (low, high, scale, offset) mapping the Box source onto the Box target as x * scale + offset
+        """
+        low, high = source.low.astype(float), source.high.astype(float)
+        scale = (target.high - target.low) / (high - low)
+        return low, high, scale, target.low - low * scale
+
+    def allocate_buffers(self, batch_shape):
+        """
+        Preallocate the flat float32 observation buffer, get_state returns views into it, the action decoders
+        with their buffers, the job state and the metrics ring buffers. batch_shape is prepended for batched envs.
+        """
+        sizes = [space.shape[0] for space in self.observation_space_env]
+        bounds = np.cumsum([0] + sizes)
+        self.obs_buffer = np.zeros(batch_shape + (bounds[-1],), dtype=np.float32)
+        self.obs_views = tuple(self.obs_buffer[..., start:end] for start, end in zip(bounds[:-1], bounds[1:]))
+        # Discrete actions pass through, Box actions are decoded into a buffer of their own
+        self.action_decoders = [(name, None if m is None else self.box_decoder(m, np.zeros(batch_shape + m[0].shape))) for name, m in zip(self.actions, self.action_maps)]
+        # next_jobs writes the observed job into this, restoring a snapshot points job_state elsewhere until then
+        self.job_buffer = np.zeros(batch_shape + (2,))
+        metrics_config = dict(self.metrics_config)
+        recorder = AsyncMetricsRecorder if metrics_config.pop("async", False) else MetricsRecorder
+        # VecDCEnv allocates again for its batch shape, the recorder of the first call has to stop its thread
+        if getattr(self, "metrics", None) is not None:
+            self.metrics.close()
+        self.metrics = recorder(self, batch_shape=batch_shape, **metrics_config)
+        if self.profiler is not None:
+            self.profiler.attach(self)
+
     def reset(self):
         self.rng = np.random.default_rng(self.seed)
 
@@ -103,13 +246,19 @@ class DCEnv(gym.Env):
         self.crah.reset(self.ambient_temp(self.time))
 
         self.flowsim.reset(self.servers, self.crah)
+        self.kernel_scratch = np.empty(max(self.n_servers, self.n_crah))
+
+        self.arrivals.clear()
 
         total_energy = (self.servers.fan_power + self.crah.fan_power + self.crah.compressor_power) * self.dt
         self.total_energy_cost = self.energy_cost * total_energy 
         self.total_job_drop_cost = self.job_drop_cost * self.servers.dropped_jobs
         self.total_overheat_cost = self.overheat_cost * self.servers.overheated_inlets
 
-        self.job = self.load_generator(self.time)
+        self.next_jobs()
+
+        if self.recorder is not None:
+            self.recorder.reset()
 
         state = self.get_state()
         return state
@@ -119,72 +268,377 @@ class DCEnv(gym.Env):
         if self.time < self.pretrain_timesteps:
             action = {}
 
-        clipped_action = map(lambda x: self.clip_action(*x), zip(action, self.action_space))
-        rescaled_action = map(lambda x: self.scale_to(*x), zip(clipped_action, self.action_space, self.action_space_env))
-        action = dict(zip(self.actions, rescaled_action))
-        if "rack" in action:
-            rack_placement = action.get("rack")
-            start = rack_placement * self.flowsim.servers_per_rack
-            end = (rack_placement + 1) * self.flowsim.servers_per_rack
-            placement = start + np.argmin(self.servers.load[start:end])
-        elif "server" in action:
-            placement = action.get("server")
-        else:
-            placement = np.argmin(self.servers.load[:self.n_place])
+        action = self.decode_action(action)
 
-        self.time += self.dt
+        # Costs are summed over all physics ticks of the control interval
+        self.total_energy_cost = 0
+        self.total_job_drop_cost = 0
+        self.total_overheat_cost = 0
+        self.steady = False # New action, so at least one tick is needed before anything can be skipped
+        self.skipped = []
+        remaining = self.substeps
+        while remaining > 0:
+            n = self.quiet_ticks(remaining) if self.fast_forward and self.steady else 0
+            if n > 0:
+                self.skip_ticks(n)
+                remaining -= n
+            else:
+                self.tick(action)
+                remaining -= 1
+        self.flush_skipped()
 
-        self.servers.update(self.time, self.dt, placement, self.job[0], self.job[1], self.flowsim.server_temp_in)
+        total_cost = self.total_energy_cost + self.total_job_drop_cost + self.total_overheat_cost
+        reward = -total_cost
+
+        if self.metrics.enabled:
+            self.metrics.record(self)
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+        state = self.get_state()
+        return state, reward, False, {}
+
+    def tick(self, action):
+        """
+        Place the current jobs and advance the simulation one dt, then draw the jobs for the next tick
+        """
+        # All jobs arriving this step are placed at once
+        load, duration = self.job
+        placement = self.place_jobs(action, load)
+
+        self.time += self.dt
 
-        # Update CRAH fans
         crah_temp = action.get("crah_out", self.crah_out_setpoint)
         crah_flow = action.get("crah_flow", self.crah_flow_setpoint * self.crah.max_flow)
+
+        self.flush_skipped()
+        if self.backend == "numba":
+            # Jobs only change the load, which is first used on the next tick, so they can go after the physics
+            change = kernel.tick(self.servers, self.crah, self.flowsim, self.dt, crah_temp, crah_flow, self.ambient_temp(self.time), self.kernel_scratch)
+            changed_jobs = self.servers.update_jobs(self.time, self.dt, placement, load, duration)
+            # A started or retired job changes the load of the next tick, so that one can't be skipped
+            self.steady = change <= self.steady_tol and changed_jobs == 0
+        else:
+            # The parts update their state buffers in place, so the previous values are only copied when needed
+            if self.fast_forward:
+                prev = tuple(np.copy(x) for x in (self.servers.temp_cpu, self.servers.flow, self.flowsim.server_temp_in, self.flowsim.server_temp_out, self.flowsim.crah_temp_in))
+
+            changed_jobs = self.update_parts(placement, load, duration, crah_temp, crah_flow)
+
+            if self.fast_forward:
+                curr = (self.servers.temp_cpu, self.servers.flow, self.flowsim.server_temp_in, self.flowsim.server_temp_out, self.flowsim.crah_temp_in)
+                self.steady = changed_jobs == 0 and all(np.max(np.abs(x - y)) <= self.steady_tol for x, y in zip(prev, curr))
+
+        self.add_costs()
+
+        # Get new jobs, arrays of expected load and duration
+        self.next_jobs()
+
+    def quiet_ticks(self, limit):
+        """
+        How many of the next ticks, at most limit, have no jobs arriving and none finishing
+        """
+        if self.job_state[0] > 0:
+            return 0
+        step = int(round(self.time / self.dt))
+        # Tick i places the jobs of step + i - 1 and retires those ending at step + i
+        n = self.arrivals.next_busy_step(step + 1) - step
+        end = self.servers.running_jobs.next_end()
+        if end is not None:
+            n = min(n, end - step - 1)
+        return max(min(n, limit), 0)
+
+    def skip_ticks(self, n):
+        """
+        Advance n quiet ticks without running the physics. The state is a fixed point while the load is unchanged,
+        only the compressor follows the ambient temp, so their cost is evaluated in one go by flush_skipped.
+        The job queue catches up on the next pop.
+        """
+        # Same rounding as adding dt once per tick
+        times = np.add.accumulate(np.concatenate([[self.time], np.full(n, self.dt)]))[1:]
+        self.skipped.append(times)
+        self.time = times[-1].item()
+        self.servers.dropped_jobs = 0
+        self.next_jobs()
+
+    def update_parts(self, placement, load, duration, crah_temp, crah_flow):
+        """
+        Advance servers, CRAH and flow one dt with the numpy backend, returns the number of started and retired jobs
+        """
+        changed_jobs = self.servers.update(self.time, self.dt, placement, load, duration, self.flowsim.server_temp_in)
+
+        # Update CRAH fans
         self.crah.update(crah_temp, crah_flow, self.flowsim.crah_temp_in, self.ambient_temp(self.time))
 
         # Run simulation based on current boundary condition
         self.flowsim.step(self.servers, self.crah)
+        return changed_jobs
 
-        # Get new job, tuple of expected (load, duration)
-        self.job = self.load_generator(self.time)
+    def place_jobs(self, action, load):
+        """
+        Server of every job arriving this step, from the action or the placement policy
+        """
+        index = self.servers.index
+        if "slot" in action:
+            placement = np.full(len(load), action.get("rack") * self.flowsim.servers_per_rack + action.get("slot"))
+        elif "rack" in action:
+            rack_placement = action.get("rack")
+            if self.placement == "first_fit":
+                placement = index.first_fit(load, self.servers.max_load, rack_placement, rack_placement + 1)
+            elif index is not None:
+                placement = index.least_loaded(len(load), rack_placement, rack_placement + 1)
+            else:
+                start = rack_placement * self.flowsim.servers_per_rack
+                end = (rack_placement + 1) * self.flowsim.servers_per_rack
+                placement = start + least_loaded(self.servers.load[None, start:end], [len(load)])
+        elif "candidate" in action:
+            placement = np.full(len(load), self.candidates[action.get("candidate")])
+        elif "server" in action:
+            placement = np.full(len(load), action.get("server"))
+        elif self.placement == "first_fit":
+            placement = index.first_fit(load, self.servers.max_load)
+        elif index is not None:
+            placement = index.least_loaded(len(load))
+        else:
+            placement = least_loaded(self.servers.load[None, :self.n_place], [len(load)])
+        return placement
 
+    def add_costs(self):
+        """
+        Add the costs of the last tick
+        """
         total_energy = (self.servers.fan_power + self.crah.fan_power + self.crah.compressor_power) * self.dt
-        self.total_energy_cost = self.energy_cost * total_energy 
-        self.total_job_drop_cost = self.job_drop_cost * self.servers.dropped_jobs
-        self.total_overheat_cost = self.overheat_cost * self.servers.overheated_inlets
-        total_cost = self.total_energy_cost + self.total_job_drop_cost + self.total_overheat_cost
-        reward = -total_cost
+        self.total_energy_cost += self.energy_cost * total_energy 
+        self.total_job_drop_cost += self.job_drop_cost * self.servers.dropped_jobs
+        self.total_overheat_cost += self.overheat_cost * self.servers.overheated_inlets
 
-        state = self.get_state()
-        return state, reward, False, {}
+    def flush_skipped(self):
+        """
+        Add the cost of the ticks skipped by fast forward, with the compressor evaluated at all their times at once
+        """
+        if len(self.skipped) == 0:
+            return
+        times = np.concatenate(self.skipped)
+        ambient_temp = (self.ambient_temp(times) * np.ones(len(times)))[:, None]
+        compressor_power = self.crah.compressor(self.flowsim.crah_temp_in, ambient_temp)
+        total_energy = (len(times) * (self.servers.fan_power + self.crah.fan_power) + np.sum(compressor_power)) * self.dt
+        self.total_energy_cost += self.energy_cost * total_energy
+        self.total_overheat_cost += self.overheat_cost * self.servers.overheated_inlets * len(times)
+        self.crah.compressor_power = compressor_power[-1]
+        self.skipped = []
+
+    def next_jobs(self):
+        """
+        Draw the jobs arriving during the next step, generators can return a single (load, duration) or arrays of
+        them. Zero load means no job, a single one stays in since Servers.start_jobs skips it.
+        """
+        load, duration = self.arrivals(self.time)
+        if not isinstance(load, np.ndarray):
+            load, duration = np.array([load], dtype=float), np.array([duration], dtype=float)
+        self.job = (load, duration)
+        # Observed as total load and mean duration, the same as (load, duration) for a single job
+        job_state = self.job_buffer
+        if len(load) == 1:
+            job_state[0], job_state[1] = (load[0], duration[0]) if load[0] > 0 else (0, 0)
+        elif len(load) == 0:
+            job_state[:] = 0
+        else:
+            jobs = load > 0
+            if not jobs.all():
+                # Placing spreads over as many servers as there are jobs
+                load, duration = load[jobs], duration[jobs]
+                self.job = (load, duration)
+            job_state[0] = np.sum(load)
+            job_state[1] = np.mean(duration) if len(load) > 0 else 0
+        self.job_state = job_state
 
     def get_state(self):
         """
-        Return a tuple of rescaled observations based on selected observations in self.observations
+        Return a tuple of rescaled observations based on selected observations in self.observations,
+        or the flat observation if flatten_observations is set.
+        The tuple entries are views into a buffer that is overwritten on the next call. The flat observation is a
+        copy of it, rllib stores flat observations as they are so a reused array would alias every sample.
         """
         states = {
             "load": self.servers.load,
             "temp_out": self.flowsim.server_temp_out,
-            "job": self.job,
+            "job": self.job_state,
         }
-        return tuple(map(lambda x: self.scale_to(*x), zip(
-            map(states.__getitem__, self.observations), 
-            self.observation_space_env, 
-            self.observation_space_target)))
-    
-    def scale_to(self, x, original_range, target_range):
+        if self.use_candidates:
+            self.candidates = self.find_candidates()
+        for name in self.observations:
+            if name not in states:
+                states[name] = self.aggregated_state(name)
+        for name, out, (_, _, scale, offset) in zip(self.observations, self.obs_views, self.observation_maps):
+            np.multiply(states[name], scale, out=out)
+            out += offset
+        return self.obs_buffer.copy() if self.flatten_observations else self.obs_views
+
+    def find_candidates(self):
+        """
+        The n_candidates least loaded servers, least loaded first, (..., n_candidates) for batched envs
+        """
+        if self.servers.index is not None:
+            return self.servers.index.least_loaded(self.n_candidates)
+        load = self.servers.load[..., :self.n_place]
+        rows = load.reshape(-1, load.shape[-1])
+        return least_loaded(rows, [self.n_candidates] * len(rows)).reshape(load.shape[:-1] + (self.n_candidates,))
+
+    def aggregated_state(self, name):
+        """
+        Size independent observations, they keep the leading env dimension of batched envs
+        """
+        index = self.servers.index
+        n_racks = self.flowsim.n_racks
+        if name == "rack_load":
+            if index is not None:
+                histogram = index.histogram
+            else:
+                load = self.servers.load.reshape(self.servers.load.shape[:-1] + (n_racks, -1))
+                histogram = rack_histogram(load, self.load_bins, self.servers.idle_load, self.servers.max_load)
+            histogram = histogram / self.flowsim.servers_per_rack
+            return histogram.reshape(histogram.shape[:-2] + (-1,))
+        elif name == "rack_temp":
+            return rack_quantiles(self.flowsim.server_temp_out, n_racks, self.temp_quantiles)
+        elif name == "candidates":
+            load = np.take_along_axis(self.servers.load, self.candidates, axis=-1)
+            temp = np.take_along_axis(self.flowsim.server_temp_out, self.candidates, axis=-1)
+            return np.concatenate([load, temp], axis=-1)
+        raise ValueError(f"Unknown observation {name}")
+
+    def decode_action(self, action):
+        """
+        Clip and rescale the agent action with the decoders built by allocate_buffers, returns a dict of env values
+        by action name
+        """
+        return {name: a if decode is None else decode(a) for (name, decode), a in zip(self.action_decoders, action)}
+
+    def box_decoder(self, action_map, out):
+        """
+        Function clipping a Box action and mapping it to env units in place in out, (low, high, scale, offset) as
+        from affine_map. A single unbatched value comes back as a float.
+        """
+        low, high, scale, offset = action_map
+        if out.shape == (1,):
+            # One unbatched setpoint, on python floats that is a fraction of the cost of the ufunc calls
+            low, high, scale, offset = (float(x[0]) for x in action_map)
+            return lambda a: min(max(float(a[0]), low), high) * scale + offset
+        def decode(a):
+            np.maximum(a, low, out=out)
+            np.minimum(out, high, out=out)
+            np.multiply(out, scale, out=out)
+            return np.add(out, offset, out=out)
+        return decode
+
+    def state_parts(self):
+        return [("", self), ("servers/", self.servers), ("crah/", self.crah), ("flowsim/", self.flowsim)]
+
+    def get_state_snapshot(self, running_jobs=True):
+        """
+        Copy of the full simulation state as a flat dict of arrays keyed "part/attribute", including the running
+        jobs and random generators. Everything is an array so np.savez(file, **snapshot) stores it as is and
+        set_state_snapshot(np.load(file)) restores it. running_jobs=False leaves the job queue out and restoring
+        then keeps the queue of the env, fork copies it directly.
+        """
+        snapshot = {}
+        for prefix, part in self.state_parts():
+            for name in part.state_attributes:
+                snapshot[prefix + name] = np.array(getattr(part, name))
+        if running_jobs:
+            for name, value in self.servers.running_jobs.get_state().items():
+                snapshot["running_jobs/" + name] = value
+        snapshot.update(self.get_jobs_snapshot())
+        for i, arrivals in enumerate(self.arrival_schedules()):
+            for name, value in arrivals.get_state().items():
+                snapshot[f"arrivals/{i}/{name}"] = value
+            # Generator states are dicts of (big) ints, kept as json strings. Every schedule saves the one of its
+            # own generator, schedules sharing one save the same state.
+            if hasattr(arrivals.generator, "rng"):
+                snapshot[f"arrivals/{i}/rng"] = np.array(json.dumps(arrivals.generator.rng.bit_generator.state))
+        snapshot["rng"] = np.array(json.dumps(self.rng.bit_generator.state))
+        return snapshot
+
+    def set_state_snapshot(self, snapshot, copy=True):
+        """
+        Restore a snapshot from get_state_snapshot. Servers, CRAH and flow always copy into their state buffers
+        and the running jobs into the job queue. copy=False only saves the copies of the arrays kept as they are,
+        the env attributes (job_state, time when batched) and the prefetched arrival blocks, which then alias
+        the snapshot.
+        """
+        for prefix, part in self.state_parts():
+            for name in part.state_attributes:
+                value = snapshot[prefix + name]
+                # 0-d arrays go back to scalars
+                setattr(part, name, value[()] if value.ndim == 0 else value.copy() if copy else value)
+        if "running_jobs/end" in snapshot:
+            self.servers.running_jobs = JobQueue()
+            self.servers.running_jobs.set_state({name: snapshot["running_jobs/" + name] for name in ["end", "load", "placement", "step"]})
+        if self.servers.index is not None:
+            self.servers.index.build(self.servers.load)
+        # The candidate action refers to the candidates of the last observation, which only depend on the load
+        if self.use_candidates:
+            self.candidates = self.find_candidates()
+        self.set_jobs_snapshot(snapshot)
+        for i, arrivals in enumerate(self.arrival_schedules()):
+            arrivals.set_state({name: snapshot[f"arrivals/{i}/{name}"] for name in ["start", "offsets", "load", "duration"]})
+            if f"arrivals/{i}/rng" in snapshot:
+                arrivals.generator.rng.bit_generator.state = json.loads(str(snapshot[f"arrivals/{i}/rng"]))
+        self.rng = np.random.default_rng()
+        self.rng.bit_generator.state = json.loads(str(snapshot["rng"]))
+        self.steady = False
+        self.skipped = []
+        self.kernel_scratch = np.empty(max(self.n_servers, self.n_crah))
+
+    def arrival_schedules(self):
+        return [self.arrivals]
+
+    def get_jobs_snapshot(self):
+        return {"job/load": self.job[0].copy(), "job/duration": self.job[1].copy()}
+
+    def set_jobs_snapshot(self, snapshot):
+        self.job = (np.array(snapshot["job/load"]), np.array(snapshot["job/duration"]))
+
+    def close(self):
         """
-        If supplied range is of type Box do a linear mapping from source to target
+        Write out whatever the metrics and the trajectory recorder still hold and stop the metrics thread
         """
-        if isinstance(original_range, gym.spaces.Box):
-            return (x - original_range.low) * (target_range.high - target_range.low) / (original_range.high - original_range.low) + target_range.low
-        else: # Can't handle rescaling other types
-            return x
+        self.metrics.close()
+        if self.recorder is not None:
+            self.recorder.close()
 
-    def clip_action(self, a, allowed_range):
+    def fork(self):
         """
-        Clip action based on the allowed range, only do it for Box space
+        Independent copy of the env at its current state for lookahead rollouts. Configuration, spaces and
+        precomputed maps are shared, only the state is copied. Forks get their own metrics, record nothing and
+        are not profiled.
         """
-        if isinstance(allowed_range, gym.spaces.Box):
-            return np.clip(a, allowed_range.low, allowed_range.high)
-        else: # Can't handle rescaling other types
-            return a
\ No newline at end of file
+        env = copy.copy(self)
+        env.servers = copy.copy(self.servers)
+        if self.servers.index is not None:
+            env.servers.index = copy.copy(self.servers.index) # Rebuilt on the copied load by set_state_snapshot
+        env.crah = copy.copy(self.crah)
+        env.flowsim = copy.copy(self.flowsim)
+        # Every generator is copied once, so schedules sharing one still do. The rng states come from the snapshot.
+        generators = {}
+        for generator in [self.load_generator] + [arrivals.generator for arrivals in self.arrival_schedules()]:
+            if id(generator) not in generators:
+                generators[id(generator)] = copy.copy(generator)
+                if hasattr(generator, "rng"):
+                    generators[id(generator)].rng = np.random.default_rng()
+        env.load_generator = generators[id(self.load_generator)]
+        schedules = [copy.copy(arrivals) for arrivals in self.arrival_schedules()]
+        for arrivals in schedules:
+            arrivals.generator = generators[id(arrivals.generator)]
+        env.arrivals = schedules if isinstance(self.arrivals, list) else schedules[0]
+        env.recorder = None
+        env.metrics = None # Still the recorder of self, which allocate_buffers would close
+        # Steps of lookahead forks would count in the profile of self
+        if self.profiler is not None:
+            env.profiler = None
+            Profiler.detach(env)
+        # Forks keep their metrics in memory, on the same thread
+        env.metrics_config = {name: value for name, value in self.metrics_config.items() if name in ("signals", "decimation", "capacity")}
+        env.allocate_buffers(self.obs_buffer.shape[:-1])
+        env.servers.running_jobs = copy.copy(self.servers.running_jobs)
+        env.set_state_snapshot(self.get_state_snapshot(running_jobs=False), copy=False)
+        return env
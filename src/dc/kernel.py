@@ -0,0 +1,169 @@
+import importlib.util
+import warnings
+
+import numpy as np
+
+# numba is only imported once the kernel is first used, importing it takes longer than the rest of the package
+available = importlib.util.find_spec("numba") is not None
+compiled = False
+numpy_block = 0 # Block size of np.sum, set by compile_kernel
+BUFFER_SIZE = 8192 # Buffer size of numpy's reductions
+
+def fan_power(flow, max_flow, max_fan_power):
+    """
+    Total fan power of the servers or CRAH units, the cube is written out as products so tick_kernel matches it exactly
+    """
+    ratio = flow / max_flow
+    return np.sum(max_fan_power * (ratio * ratio * ratio), axis=-1)
+
+def pairwise_sum(a, start, n, block):
+    """
+    Sum of a[start:start+n] in the same order as np.sum, so results are bit identical. numpy sums pairwise within
+    blocks of block elements and adds up the block sums in order, block 0 is one block for the whole range.
+    """
+    if block == 0 or n <= block:
+        return pairwise_block(a, start, n)
+    res = 0.0
+    for block_start in range(start, start + n, block):
+        res += pairwise_block(a, block_start, min(block, start + n - block_start))
+    return res
+
+def pairwise_block(a, start, n):
+    """
+    numpy's pairwise summation of a[start:start+n]
+    """
+    if n < 8:
+        res = 0.0
+        for i in range(start, start + n):
+            res += a[i]
+        return res
+    elif n <= 128:
+        r0, r1, r2, r3 = a[start], a[start + 1], a[start + 2], a[start + 3]
+        r4, r5, r6, r7 = a[start + 4], a[start + 5], a[start + 6], a[start + 7]
+        i = 8
+        while i < n - n % 8:
+            j = start + i
+            r0 += a[j]
+            r1 += a[j + 1]
+            r2 += a[j + 2]
+            r3 += a[j + 3]
+            r4 += a[j + 4]
+            r5 += a[j + 5]
+            r6 += a[j + 6]
+            r7 += a[j + 7]
+            i += 8
+        res = ((r0 + r1) + (r2 + r3)) + ((r4 + r5) + (r6 + r7))
+        while i < n:
+            res += a[start + i]
+            i += 1
+        return res
+    else:
+        n2 = n // 2
+        n2 -= n2 % 8
+        return pairwise_block(a, start, n2) + pairwise_block(a, start + n2, n - n2)
+
+def sum_block():
+    """
+    Block size np.sum works in on contiguous float64 arrays. Older numpy versions reduce through buffers of 8192
+    elements, newer ones sum the whole array pairwise. Found by summing arrays on which the two orders differ.
+    """
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        a = rng.uniform(0, 1, 2 * BUFFER_SIZE + 100) ** 3
+        blocked, whole = pairwise_sum(a, 0, len(a), BUFFER_SIZE), pairwise_block(a, 0, len(a))
+        if blocked != whole:
+            if np.sum(a) == blocked:
+                return BUFFER_SIZE
+            elif np.sum(a) != whole:
+                warnings.warn("np.sum adds up in an unknown order, the numba backend will differ from numpy by rounding")
+            return 0
+    return 0
+
+def tick_kernel(load, temp_cpu, flow, delta_t, server_temp_in, server_temp_out, crah_flow, crah_temp_out, crah_temp_in, scratch, block,
+                dt, R, Ti, target_temp_cpu, min_flow, max_flow, max_fan_power, air_vol_heatcap,
+                crah_max_flow, crah_max_fan_power, crah_air_vol_heatcap, ambient_temp):
+    """
+    One tick of Servers.update (without jobs), CRAH.update and SimpleFlow.step with every array updated in place.
+    Mirrors the numpy expressions operation by operation. Returns the scalar results and the largest state change.
+    """
+    n_servers = len(load)
+    n_crah = len(crah_flow)
+    change = 0.0
+
+    # Servers
+    overheated_inlets = 0
+    for i in range(n_servers):
+        new_temp_cpu = server_temp_in[i] + R * load[i] / flow[i]
+        delta_flow = dt / Ti * (target_temp_cpu - temp_cpu[i])
+        new_flow = min(max(flow[i] + delta_flow, min_flow), max_flow)
+        delta_t[i] = load[i] / (air_vol_heatcap * flow[i])
+        change = max(change, abs(new_temp_cpu - temp_cpu[i]), abs(new_flow - flow[i]))
+        temp_cpu[i] = new_temp_cpu
+        flow[i] = new_flow
+        if server_temp_in[i] > 27:
+            overheated_inlets += 1
+        ratio = flow[i] / max_flow
+        scratch[i] = max_fan_power * (ratio * ratio * ratio)
+    server_fan_power = pairwise_sum(scratch, 0, n_servers, block)
+
+    # CRAH, setpoints already written to crah_flow and crah_temp_out
+    for i in range(n_crah):
+        ratio = crah_flow[i] / crah_max_flow
+        scratch[i] = crah_max_fan_power * (ratio * ratio * ratio)
+    crah_fan_power = pairwise_sum(scratch, 0, n_crah, block)
+    for i in range(n_crah):
+        on = crah_air_vol_heatcap if ambient_temp > crah_temp_out[i] else 0.0
+        scratch[i] = on * crah_flow[i] * (crah_temp_in[i] - crah_temp_out[i])
+    compressor_power = pairwise_sum(scratch, 0, n_crah, block)
+
+    # Flow
+    server_flow_total = pairwise_sum(flow, 0, n_servers, block)
+    crah_flow_total = pairwise_sum(crah_flow, 0, n_crah, block)
+    for i in range(n_servers):
+        scratch[i] = flow[i] * server_temp_out[i]
+    prev_server_temp_out_avg = pairwise_sum(scratch, 0, n_servers, block) / server_flow_total
+    recirculation = max(0.0, 1 - crah_flow_total / server_flow_total)
+    bypass = max(0.0, 1 - server_flow_total / crah_flow_total)
+    prev_crah_temp_out = crah_temp_out[0]
+
+    new_server_temp_in = (1 - recirculation) * prev_crah_temp_out + recirculation * prev_server_temp_out_avg
+    for i in range(n_servers):
+        new_server_temp_out = server_temp_in[i] + delta_t[i]
+        change = max(change, abs(new_server_temp_out - server_temp_out[i]), abs(new_server_temp_in - server_temp_in[i]))
+        server_temp_out[i] = new_server_temp_out
+        server_temp_in[i] = new_server_temp_in
+    new_crah_temp_in = (1 - bypass) * prev_server_temp_out_avg + bypass * prev_crah_temp_out
+    for i in range(n_crah):
+        change = max(change, abs(new_crah_temp_in - crah_temp_in[i]))
+        crah_temp_in[i] = new_crah_temp_in
+
+    return server_fan_power, overheated_inlets, crah_fan_power, compressor_power, change
+
+def compile_kernel():
+    """
+    Replace the python functions with their jitted versions, compilation happens on the first call
+    """
+    global pairwise_sum, pairwise_block, tick_kernel, compiled, numpy_block
+    import numba
+    numpy_block = sum_block()
+    pairwise_sum = numba.njit(pairwise_sum)
+    pairwise_block = numba.njit(pairwise_block)
+    tick_kernel = numba.njit(tick_kernel)
+    compiled = True
+
+def tick(servers, crah, flowsim, dt, crah_temp, crah_flow, ambient_temp, scratch):
+    """
+    Advance a single datacenter one dt in place, bit identical to Servers.update, CRAH.update and SimpleFlow.step
+    in that order but without placing or retiring jobs. Returns the largest change of the thermal state.
+    """
+    if not compiled:
+        compile_kernel()
+    crah.temp_out[:] = crah_temp
+    crah.flow[:] = crah_flow
+    result = tick_kernel(
+        servers.load, servers.temp_cpu, servers.flow, servers.delta_t,
+        flowsim.server_temp_in, flowsim.server_temp_out, crah.flow, crah.temp_out, flowsim.crah_temp_in, scratch, numpy_block,
+        float(dt), servers.R, servers.Ti, float(servers.target_temp_cpu), servers.min_flow, servers.max_flow, servers.max_fan_power, servers.air_vol_heatcap,
+        crah.max_flow, crah.max_fan_power, crah.air_vol_heatcap, float(np.asarray(ambient_temp).reshape(-1)[0]))
+    servers.fan_power, servers.overheated_inlets, crah.fan_power, crah.compressor_power, change = result
+    return change
@@ -0,0 +1,345 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+# Scalar signals (one value per datacenter), reductions are over the last axis so they also work batched
+SCALAR_SIGNALS = {
+    "srv/max_temp_cpu": lambda env: np.max(env.servers.temp_cpu, axis=-1),
+    "srv/server_total_flow": lambda env: np.sum(env.servers.flow, axis=-1),
+    "srv/overheated_inlets": lambda env: env.servers.overheated_inlets,
+    "srv/avg_temp_in": lambda env: np.sum(env.flowsim.server_temp_in * env.servers.flow, axis=-1) / np.sum(env.servers.flow, axis=-1),
+    "srv/avg_temp_out": lambda env: np.sum(env.flowsim.server_temp_out * env.servers.flow, axis=-1) / np.sum(env.servers.flow, axis=-1),
+    "srv/avg_temp_cpu": lambda env: np.mean(env.servers.temp_cpu, axis=-1),
+    "srv/load_variance": lambda env: np.var(env.servers.load, axis=-1),
+    "crah/crah_total_flow": lambda env: np.sum(env.crah.flow, axis=-1),
+    "job/load": lambda env: env.job_state[..., 0],
+    "job/duration": lambda env: env.job_state[..., 1],
+    "job/running": lambda env: env.servers.n_running(),
+    "job/dropped": lambda env: env.servers.dropped_jobs,
+    "power/server_fan": lambda env: env.servers.fan_power,
+    "power/crah_fan": lambda env: env.crah.fan_power,
+    "power/compressor": lambda env: env.crah.compressor_power,
+    "power/total_server_load": lambda env: np.sum(env.servers.load, axis=-1),
+    "power/PUE": lambda env: (env.servers.fan_power + env.crah.fan_power + env.crah.compressor_power + np.sum(env.servers.load, axis=-1)) / np.sum(env.servers.load, axis=-1),
+    "cost/energy": lambda env: env.total_energy_cost,
+    "cost/dropped": lambda env: env.total_job_drop_cost,
+    "cost/temp_cold_isle": lambda env: env.total_overheat_cost,
+    "other/ambient_temp": lambda env: env.ambient_temp(env.time),
+}
+
+# What visualize.ipynb plots, main.py records these unless given other signals. Without signals nothing is recorded
+# and the env skips the recorder altogether. "all" in the signals stands for every scalar signal.
+PLOT_SIGNALS = [
+    "cost/energy", "cost/dropped", "cost/temp_cold_isle", "job/dropped",
+    "power/server_fan", "power/crah_fan", "power/compressor", "power/total_server_load", "srv/server_total_flow",
+]
+
+# Per server/CRAH signals, only kept in the columnar chunks
+ARRAY_SIGNALS = {
+    "srv/load": lambda env: env.servers.load,
+    "srv/temp_cpu": lambda env: env.servers.temp_cpu,
+    "srv/flow": lambda env: env.servers.flow,
+    "srv/temp_in": lambda env: env.flowsim.server_temp_in,
+    "srv/temp_out": lambda env: env.flowsim.server_temp_out,
+    "crah/temp_in": lambda env: env.flowsim.crah_temp_in,
+    "crah/temp_out": lambda env: env.crah.temp_out,
+    "crah/flow": lambda env: env.crah.flow,
+}
+
+# Raw state copied every step by AsyncMetricsRecorder, enough to evaluate all signals on the consumer side
+RAW_FIELDS = {
+    "time": lambda env: env.time,
+    "ambient": lambda env: env.ambient_temp(env.time),
+    "job_state": lambda env: env.job_state,
+    "total_energy_cost": lambda env: env.total_energy_cost,
+    "total_job_drop_cost": lambda env: env.total_job_drop_cost,
+    "total_overheat_cost": lambda env: env.total_overheat_cost,
+    "servers.load": lambda env: env.servers.load,
+    "servers.temp_cpu": lambda env: env.servers.temp_cpu,
+    "servers.flow": lambda env: env.servers.flow,
+    "servers.overheated_inlets": lambda env: env.servers.overheated_inlets,
+    "servers.dropped_jobs": lambda env: env.servers.dropped_jobs,
+    "servers.fan_power": lambda env: env.servers.fan_power,
+    "servers.running": lambda env: env.servers.n_running(),
+    "crah.flow": lambda env: env.crah.flow,
+    "crah.temp_out": lambda env: env.crah.temp_out,
+    "crah.fan_power": lambda env: env.crah.fan_power,
+    "crah.compressor_power": lambda env: env.crah.compressor_power,
+    "flowsim.server_temp_in": lambda env: env.flowsim.server_temp_in,
+    "flowsim.server_temp_out": lambda env: env.flowsim.server_temp_out,
+    "flowsim.crah_temp_in": lambda env: env.flowsim.crah_temp_in,
+}
+
+class MetricsRecorder:
+    """
+    Records selected signals every decimation steps into preallocated ring buffers inside the env, by default
+    none. enabled tells the env whether to call record at all.
+
+    Scalar signals also keep running mean/max accumulators that summary() hands out and resets, that is what
+    goes to tune. If path is set the buffers are written as columnar npz chunks whenever they fill up and on
+    flush(), otherwise the ring just wraps around.
+    """
+    def __init__(self, env, signals=None, decimation=1, capacity=1000, path=None, batch_shape=()):
+        signals = [] if signals is None else signals
+        signals = [s for name in signals for s in (SCALAR_SIGNALS if name == "all" else [name])]
+        self.scalar_names = [name for name in signals if name in SCALAR_SIGNALS]
+        self.array_names = [name for name in signals if name in ARRAY_SIGNALS]
+        unknown = set(signals) - set(self.scalar_names) - set(self.array_names)
+        assert len(unknown) == 0, f"Unknown metrics {unknown}"
+        self.scalar_funcs = [SCALAR_SIGNALS[name] for name in self.scalar_names]
+        self.enabled = len(signals) > 0
+
+        self.decimation = decimation
+        self.capacity = capacity
+        self.path = path
+        self.prefix = f"metrics_{os.getpid()}_{env.env_id}" # Envs of one process can share the path
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+        self.steps = 0
+        self.pos = 0
+        self.chunk = 0
+        self.time = np.zeros((capacity,) + batch_shape)
+        self.scalars = np.zeros((capacity, len(self.scalar_names)) + batch_shape)
+        self.arrays = {name: np.zeros((capacity,) + batch_shape + ((env.n_servers,) if name.startswith("srv") else (env.n_crah,))) for name in self.array_names}
+
+        self.sum = np.zeros((len(self.scalar_names),) + batch_shape)
+        self.max = np.full((len(self.scalar_names),) + batch_shape, -np.inf)
+        self.count = np.zeros(batch_shape)
+
+    def record(self, env):
+        self.steps += 1
+        if self.steps % self.decimation != 0:
+            return
+
+        row = self.scalars[self.pos]
+        for i, func in enumerate(self.scalar_funcs):
+            row[i] = func(env)
+        for name in self.array_names:
+            self.arrays[name][self.pos] = ARRAY_SIGNALS[name](env)
+        self.time[self.pos] = env.time
+
+        self.sum += row
+        np.maximum(self.max, row, out=self.max)
+        self.count += 1
+
+        self.pos += 1
+        if self.pos == self.capacity:
+            self.flush()
+
+    def append(self, time, rows, arrays):
+        """
+        Add k already evaluated steps at once, rows is (k, n_scalars) + batch_shape and arrays (k, ...) per array signal
+        """
+        self.sum += np.sum(rows, axis=0)
+        np.maximum(self.max, np.max(rows, axis=0), out=self.max)
+        self.count += len(rows)
+
+        written = 0
+        while written < len(rows):
+            n = min(len(rows) - written, self.capacity - self.pos)
+            self.scalars[self.pos:self.pos + n] = rows[written:written + n]
+            for name in self.array_names:
+                self.arrays[name][self.pos:self.pos + n] = arrays[name][written:written + n]
+            self.time[self.pos:self.pos + n] = time[written:written + n]
+            self.pos += n
+            written += n
+            if self.pos == self.capacity:
+                self.flush()
+
+    def summary(self, index=...):
+        """
+        Mean and max of every scalar signal since the last summary, for the env at index if batched. The max is
+        keyed max/<name>, apart from the signal names so filtering the logs on a name only finds its mean.
+        """
+        count = self.count[index]
+        mean = self.sum[:, index] / max(count, 1)
+        summary = {name: float(value) for name, value in zip(self.scalar_names, mean)}
+        summary.update({"max/" + name: float(value) for name, value in zip(self.scalar_names, self.max[:, index])})
+        self.sum[:, index] = 0
+        self.max[:, index] = -np.inf
+        self.count[index] = 0
+        return summary
+
+    def flush(self):
+        """
+        Write everything recorded since the last flush as one chunk
+        """
+        if self.path is not None and self.pos > 0:
+            columns = {"time": self.time[:self.pos]}
+            columns.update({name: self.scalars[:self.pos, i] for i, name in enumerate(self.scalar_names)})
+            columns.update({name: self.arrays[name][:self.pos] for name in self.array_names})
+            filename = os.path.join(self.path, f"{self.prefix}_{self.chunk:06d}.npz")
+            np.savez(filename, **{name.replace("/", "."): value for name, value in columns.items()})
+            self.chunk += 1
+        self.pos = 0
+
+    def close(self):
+        self.flush()
+
+    def at(self, index):
+        """
+        The recorder as seen from a single env of a batch
+        """
+        return _RecorderAt(self, index)
+
+class _RecorderAt:
+    def __init__(self, recorder, index):
+        self.recorder = recorder
+        self.index = index
+
+    def summary(self):
+        return self.recorder.summary(self.index)
+
+    def flush(self):
+        self.recorder.flush()
+
+class AsyncMetricsRecorder:
+    """
+    MetricsRecorder with the signals evaluated on a background thread. record only copies the raw state
+    (RAW_FIELDS) into a ring of ring_size steps, the consumer evaluates the signals for every step it finds in
+    the ring at once, they are written with axis=-1 reductions so the extra step axis just comes along. The
+    consumer is only woken once batch steps are waiting (or on summary/flush) to keep thread switches rare.
+
+    When the consumer falls behind, policy "block" waits for a free slot and "drop" skips the step. Both are
+    counted and reported in the summary as log/wait_time and log/dropped_steps.
+    """
+    def __init__(self, env, signals=None, decimation=1, capacity=1000, path=None, batch_shape=(), ring_size=256, policy="block", batch=None):
+        assert policy in ("block", "drop"), f"Unknown policy {policy}"
+        self.recorder = MetricsRecorder(env, signals, 1, capacity, path, batch_shape)
+        self.enabled = self.recorder.enabled
+        self.decimation = decimation
+        self.ring_size = ring_size
+        self.policy = policy
+        self.batch = max(ring_size // 4, 1) if batch is None else batch
+
+        self.steps = 0
+        self.head = 0 # Steps written
+        self.tail = 0 # Steps consumed
+        self.ring = None
+        self.dropped = 0
+        self.wait_time = 0.0
+        self.error = None
+        self.closed = False
+        self.syncing = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.consume, daemon=True)
+        self.thread.start()
+
+    def record(self, env):
+        self.steps += 1
+        if self.steps % self.decimation != 0:
+            return
+        if self.ring is None:
+            values = {name: np.asarray(field(env)) for name, field in RAW_FIELDS.items()}
+            self.ring = {name: np.zeros((self.ring_size,) + value.shape) for name, value in values.items()}
+
+        with self.condition:
+            if self.head - self.tail == self.ring_size:
+                if self.policy == "drop":
+                    self.dropped += 1
+                    return
+                start = time.perf_counter()
+                self.condition.notify_all()
+                self.wait(lambda: self.head - self.tail < self.ring_size)
+                self.wait_time += time.perf_counter() - start
+        # The consumer doesn't touch the slot until head moves past it
+        slot = self.head % self.ring_size
+        for name, field in RAW_FIELDS.items():
+            self.ring[name][slot] = field(env)
+        with self.condition:
+            self.head += 1
+            if self.head - self.tail >= self.batch:
+                self.condition.notify_all()
+
+    def wait(self, predicate):
+        while not predicate():
+            if self.error is not None:
+                raise RuntimeError("Metrics consumer failed") from self.error
+            self.condition.wait(0.1)
+
+    def consume(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.head - self.tail >= self.batch or (self.head > self.tail and self.syncing) or self.closed)
+                    if self.head == self.tail: # Closed
+                        return
+                    start, stop = self.tail, self.head
+                # At most two contiguous pieces of the ring
+                while start < stop:
+                    first = start % self.ring_size
+                    n = min(stop - start, self.ring_size - first)
+                    self.evaluate(first, first + n)
+                    start += n
+                with self.condition:
+                    self.tail = stop
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+
+    def evaluate(self, first, last):
+        """
+        Evaluate the signals for the ring slots [first, last) and hand them to the recorder
+        """
+        raw = {name: values[first:last] for name, values in self.ring.items()}
+        running = raw["servers.running"]
+        ambient = raw["ambient"]
+        env = SimpleNamespace(
+            time=raw["time"],
+            ambient_temp=lambda t: ambient,
+            job_state=raw["job_state"],
+            total_energy_cost=raw["total_energy_cost"],
+            total_job_drop_cost=raw["total_job_drop_cost"],
+            total_overheat_cost=raw["total_overheat_cost"],
+            servers=SimpleNamespace(n_running=lambda: running, **{name.split(".")[1]: raw[name] for name in raw if name.startswith("servers.")}),
+            crah=SimpleNamespace(**{name.split(".")[1]: raw[name] for name in raw if name.startswith("crah.")}),
+            flowsim=SimpleNamespace(**{name.split(".")[1]: raw[name] for name in raw if name.startswith("flowsim.")}),
+        )
+        recorder = self.recorder
+        rows = np.stack([np.broadcast_to(func(env), raw["time"].shape) for func in recorder.scalar_funcs], axis=1) if recorder.scalar_funcs else np.zeros((last - first, 0) + raw["time"].shape[1:])
+        arrays = {name: ARRAY_SIGNALS[name](env) for name in recorder.array_names}
+        recorder.append(raw["time"], rows, arrays)
+
+    def sync(self):
+        """
+        Wait until the consumer has caught up
+        """
+        with self.condition:
+            self.syncing = True
+            self.condition.notify_all()
+            self.wait(lambda: self.tail == self.head)
+            self.syncing = False
+
+    def summary(self, index=...):
+        self.sync()
+        summary = self.recorder.summary(index)
+        summary["log/dropped_steps"] = self.dropped
+        summary["log/wait_time"] = self.wait_time
+        self.dropped = 0
+        self.wait_time = 0.0
+        return summary
+
+    def flush(self):
+        self.sync()
+        self.recorder.flush()
+
+    def close(self):
+        """
+        Flush and stop the consumer thread, safe to call more than once
+        """
+        if self.closed:
+            return
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def at(self, index):
+        return _RecorderAt(self, index)
@@ -0,0 +1,19 @@
+import numpy as np
+
+def rack_histogram(load, bins, low, high):
+    """
+    Number of servers per load bin for (..., n_racks, servers_per_rack) load, returns (..., n_racks, bins).
+    The bins split low..high evenly, values outside go to the first or last bin.
+    """
+    index = np.clip(((load - low) * (bins / (high - low))).astype(np.int64), 0, bins - 1)
+    rows = index.reshape(-1, index.shape[-1])
+    flat = rows + bins * np.arange(len(rows))[:, None]
+    return np.bincount(flat.reshape(-1), minlength=len(rows) * bins).reshape(load.shape[:-1] + (bins,))
+
+def rack_quantiles(values, n_racks, quantiles):
+    """
+    Quantiles per rack of (..., n_servers) values, returns (..., n_racks * len(quantiles)) grouped by rack
+    """
+    values = values.reshape(values.shape[:-1] + (n_racks, -1))
+    result = np.moveaxis(np.quantile(values, quantiles, axis=-1), 0, -1)
+    return result.reshape(result.shape[:-2] + (-1,))
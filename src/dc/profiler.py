@@ -0,0 +1,139 @@
+import functools
+import time
+import tracemalloc
+
+# Methods timed per part of the env, missing ones are skipped (e.g. vector_step on a DCEnv). step and tick
+# contain the others, the rest don't overlap except servers.update_jobs inside servers.update.
+PHASES = {
+    "": ["step", "vector_step", "tick", "decode_action", "place_jobs", "add_costs", "update_costs", "flush_skipped", "next_jobs", "get_state"],
+    "servers": ["update", "update_jobs"],
+    "crah": ["update"],
+    "flowsim": ["step"],
+    "metrics": ["record"],
+    "recorder": ["record"],
+}
+
+class Profiler:
+    """
+    Cumulative wall time and calls per phase of the env, plus the depth of the job queue after every tick. attach
+    swaps the classes of the env and its parts for subclasses with timed methods, so an env without a profiler
+    runs exactly the original code. The subclasses hold the profiler as a class attribute and add no slots, so
+    this also works for the parts using __slots__.
+
+    With memory the phases are also traced with tracemalloc: the highest peak above the memory in use when the
+    phase started and the net bytes it left allocated. Tracing slows everything down a lot, so it is off by
+    default and the times are not comparable with it on. It resets the tracemalloc peak on every phase, so the
+    peak of tracemalloc.get_traced_memory() over a whole run needs a run without it.
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stack = [] # [memory at start, peak so far] of the traced calls in progress
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.reset()
+
+    def reset(self):
+        self.time = {}
+        self.calls = {}
+        self.peak = {}
+        self.allocated = {}
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.depth_count = 0
+
+    def attach(self, env):
+        for path, names in PHASES.items():
+            part = getattr(env, path) if path else env
+            if part is None:
+                continue
+            names = tuple(name for name in names if hasattr(part, name))
+            part.__class__ = profiled_class(type(part), f"{path}." if path else "", names, self)
+
+    @staticmethod
+    def detach(env):
+        """
+        Give the env and its parts their original classes back, e.g. for copies that shouldn't be profiled
+        """
+        for path in PHASES:
+            part = getattr(env, path) if path else env
+            if part is not None and getattr(type(part), "_profiler", None) is not None:
+                part.__class__ = type(part).__base__
+
+    def add(self, phase, elapsed):
+        self.time[phase] = self.time.get(phase, 0.0) + elapsed
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def enter(self):
+        # The tracemalloc peak is global, hand it to the enclosing call before resetting it for this one
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self.stack.append([current, current])
+
+    def exit(self, phase):
+        current, peak = tracemalloc.get_traced_memory()
+        start, top = self.stack.pop()
+        peak = max(top, peak)
+        if self.stack:
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+        self.peak[phase] = max(self.peak.get(phase, 0), peak - start)
+        self.allocated[phase] = self.allocated.get(phase, 0) + current - start
+
+    def add_depth(self, depth):
+        self.depth_sum += depth
+        self.depth_max = max(self.depth_max, depth)
+        self.depth_count += 1
+
+    def summary(self):
+        """
+        Totals since the last summary as a flat dict for custom metrics, then starts over
+        """
+        summary = {}
+        for phase in self.time:
+            summary[f"prof/{phase}_time"] = self.time[phase]
+            summary[f"prof/{phase}_calls"] = self.calls[phase]
+            if self.memory:
+                summary[f"prof/{phase}_peak_bytes"] = self.peak[phase]
+                summary[f"prof/{phase}_allocated_bytes"] = self.allocated[phase]
+        summary["prof/queue_depth_mean"] = self.depth_sum / max(self.depth_count, 1)
+        summary["prof/queue_depth_max"] = self.depth_max
+        self.reset()
+        return summary
+
+def profiled_class(cls, prefix, names, profiler):
+    if getattr(cls, "_profiler", None) is profiler:
+        return cls
+    if getattr(cls, "_profiler", None) is not None: # Attached to another profiler before
+        cls = cls.__base__
+    namespace = {name: timed(getattr(cls, name), prefix + name, profiler.memory) for name in names}
+    namespace["_profiler"] = profiler
+    namespace["__slots__"] = ()
+    namespace["__module__"] = cls.__module__
+    return type(cls.__name__, (cls,), namespace)
+
+def timed(method, phase, memory):
+    if memory:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self._profiler.enter()
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._profiler.add(phase, time.perf_counter() - start)
+                self._profiler.exit(phase)
+                if phase == "servers.update_jobs":
+                    self._profiler.add_depth(len(self.running_jobs))
+        return wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._profiler.add(phase, time.perf_counter() - start)
+            if phase == "servers.update_jobs":
+                self._profiler.add_depth(len(self.running_jobs))
+    return wrapper
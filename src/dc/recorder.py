@@ -0,0 +1,134 @@
+import json
+import os
+
+import numpy as np
+
+from dc.metrics import SCALAR_SIGNALS, ARRAY_SIGNALS
+
+# Full state written every step by default, names as in dc.metrics
+COLUMNS = list(ARRAY_SIGNALS) + [
+    "srv/overheated_inlets", "job/dropped", "job/load",
+    "power/server_fan", "power/crah_fan", "power/compressor",
+    "cost/energy", "cost/dropped", "cost/temp_cold_isle",
+    "other/ambient_temp",
+]
+
+class TrajectoryRecorder:
+    """
+    Streams the env state to an append only columnar store, one raw memory mapped file per column in path
+    plus meta.json describing them. Files grow by chunk_steps rows at a time and are trimmed on close.
+
+    Every row also gets the episode number, the env time and a step counter over the whole run so
+    TrajectoryReader can find time ranges with a binary search.
+    """
+    def __init__(self, path, columns=None, dtype="float32", chunk_steps=10000):
+        self.path = path
+        self.columns = COLUMNS if columns is None else columns
+        self.dtype = np.dtype(dtype)
+        self.chunk_steps = chunk_steps
+        os.makedirs(path, exist_ok=True)
+
+        self.n_steps = 0
+        self.capacity = 0
+        self.episode = -1
+        self.maps = None
+
+    def reset(self):
+        self.episode += 1
+
+    def record(self, env):
+        values = {"episode": self.episode, "time": env.time, "step": self.n_steps}
+        for name in self.columns:
+            values[name] = (ARRAY_SIGNALS.get(name) or SCALAR_SIGNALS[name])(env)
+
+        if self.maps is None:
+            # Row shapes are only known from the first record, batched envs get an extra env axis
+            self.shapes = {name: np.shape(value) for name, value in values.items()}
+            self.dtypes = {name: self.dtype for name in values}
+            self.dtypes.update(episode=np.dtype("int64"), step=np.dtype("int64"), time=np.dtype("float64"))
+            self.maps = {}
+        if self.n_steps == self.capacity:
+            self.grow(self.capacity + self.chunk_steps)
+
+        for name, value in values.items():
+            self.maps[name][self.n_steps] = value
+        self.n_steps += 1
+
+    def grow(self, capacity):
+        self.flush()
+        for name in self.shapes:
+            size = capacity * int(np.prod(self.shapes[name], dtype=int)) * self.dtypes[name].itemsize
+            with open(self.filename(name), "ab") as f:
+                f.truncate(size)
+            self.maps[name] = np.memmap(self.filename(name), dtype=self.dtypes[name], mode="r+", shape=(capacity,) + self.shapes[name])
+        self.capacity = capacity
+        self.write_meta()
+
+    def flush(self):
+        if not self.maps:
+            return
+        for m in self.maps.values():
+            m.flush()
+        self.write_meta()
+
+    def close(self):
+        """
+        Flush and cut the files down to the recorded rows
+        """
+        if self.maps is None:
+            return
+        self.flush()
+        self.maps = None
+        for name in self.shapes:
+            size = self.n_steps * int(np.prod(self.shapes[name], dtype=int)) * self.dtypes[name].itemsize
+            with open(self.filename(name), "r+b") as f:
+                f.truncate(size)
+        self.capacity = self.n_steps
+
+    def write_meta(self):
+        meta = {
+            "n_steps": self.n_steps,
+            "columns": {name: {"shape": list(self.shapes[name]), "dtype": self.dtypes[name].str} for name in self.shapes},
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def filename(self, name):
+        return os.path.join(self.path, name.replace("/", ".") + ".bin")
+
+class TrajectoryReader:
+    """
+    Read only access to a recorded trajectory without loading it, slicing only reads the requested rows and servers
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.n_steps = meta["n_steps"]
+        self.columns = {}
+        for name, column in meta["columns"].items():
+            shape = (self.n_steps,) + tuple(column["shape"])
+            filename = os.path.join(path, name.replace("/", ".") + ".bin")
+            self.columns[name] = np.memmap(filename, dtype=column["dtype"], mode="r", shape=shape) if self.n_steps > 0 else np.zeros(shape, dtype=column["dtype"])
+
+    def rows(self, start_time=None, end_time=None, episode=None):
+        """
+        Row range covering env time [start_time, end_time) of the episode, the last one by default
+        """
+        episodes = self.columns["episode"]
+        episode = episodes[-1] if episode is None else episode
+        first, last = np.searchsorted(episodes, episode, "left"), np.searchsorted(episodes, episode, "right")
+        time = self.columns["time"][first:last]
+        time = time.reshape(len(time), -1)[:, 0] # Batched envs step together, the first env is enough
+        start = first if start_time is None else first + np.searchsorted(time, start_time, "left")
+        stop = last if end_time is None else first + np.searchsorted(time, end_time, "left")
+        return slice(start, stop)
+
+    def read(self, name, start_time=None, end_time=None, servers=None, episode=None):
+        """
+        Column values over a time range, servers selects along the last axis (servers or CRAH units)
+        """
+        values = self.columns[name][self.rows(start_time, end_time, episode)]
+        if servers is not None:
+            values = values[..., servers]
+        return np.array(values)
@@ -0,0 +1,103 @@
+import numpy as np
+
+class PrefetchedArrival:
+    """
+    Draws the jobs of block steps at once with the schedule method of the generator, calls then read the jobs of a
+    step by index. Times are rounded to the dt grid, a time outside the block starts a new one there. Generators
+    without schedule are called directly.
+    """
+    def __init__(self, generator, dt, block=10000):
+        self.generator = generator
+        self.dt = dt
+        self.block = block if hasattr(generator, "schedule") else 0
+        self.clear()
+
+    def clear(self):
+        """
+        Drop the prefetched jobs, random generators draw new ones on the next call
+        """
+        self.start = None
+
+    def fill(self, step):
+        counts, self.load, self.duration = self.generator.schedule((step + np.arange(self.block)) * self.dt)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.start = step
+        self.busy = None
+
+    def next_busy_step(self, step):
+        """
+        First step from step on with a job (of non-zero load), looking no further than the end of the block.
+        Without a block every step can have jobs, so that is step.
+        """
+        if self.block == 0:
+            return step
+        if self.start is None or not self.start <= step < self.start + self.block:
+            self.fill(step)
+        if self.busy is None:
+            # Block steps with jobs, from the running count of non-zero loads at the step offsets
+            jobs = np.concatenate([[0], np.cumsum(self.load > 0)])[self.offsets]
+            self.busy = np.flatnonzero(np.diff(jobs))
+        i = np.searchsorted(self.busy, step - self.start)
+        return self.start + (self.busy[i] if i < len(self.busy) else self.block)
+
+    def __call__(self, t):
+        if self.block == 0:
+            return self.generator(t)
+        step = int(round(t / self.dt))
+        if self.start is None or not self.start <= step < self.start + self.block:
+            self.fill(step)
+        first, last = self.offsets[step - self.start], self.offsets[step - self.start + 1]
+        return (self.load[first:last], self.duration[first:last])
+
+    def get_state(self):
+        """
+        The prefetched block, the arrays are never changed in place so they are shared and not copied
+        """
+        if self.start is None:
+            return {"start": np.array(-1), "offsets": np.zeros(1, dtype=np.int64), "load": np.zeros(0), "duration": np.zeros(0)}
+        return {"start": np.array(self.start), "offsets": self.offsets, "load": self.load, "duration": self.duration}
+
+    def set_state(self, state):
+        self.start = None if int(state["start"]) < 0 else int(state["start"])
+        self.offsets, self.load, self.duration = (np.asarray(state[name]) for name in ["offsets", "load", "duration"])
+        self.busy = None
+
+class PrefetchedTemperature:
+    """
+    Evaluates a vectorized temperature generator over block steps at once, calls then read the value by index.
+    Times are rounded to the dt grid, times outside the block start a new one there. Arrays of times start it at
+    their first time and only go to the generator directly if they span more than a block.
+    """
+    def __init__(self, generator, dt, block=10000):
+        self.generator = generator
+        self.dt = dt
+        self.block = block
+        self.start = None
+
+    def fill(self, step):
+        times = (step + np.arange(self.block)) * self.dt
+        self.values = np.broadcast_to(self.generator(times), times.shape)
+        self.value_list = self.values.tolist() # Indexing a list is faster for single values
+        self.start = step
+
+    def __call__(self, t):
+        if self.block == 0:
+            return self.generator(t)
+        if isinstance(t, np.ndarray) and t.ndim > 0:
+            step = np.round(t / self.dt).astype(np.int64)
+            first, last = np.min(step), np.max(step)
+            if self.start is None or first < self.start or last >= self.start + self.block:
+                if last - first >= self.block:
+                    return self.generator(t)
+                self.fill(int(first))
+            return self.values[step - self.start]
+        step = int(round(t / self.dt))
+        if self.start is None or not self.start <= step < self.start + self.block:
+            self.fill(step)
+        return self.value_list[step - self.start]
+
+    def min_values(self):
+        return self.generator.min_values()
+
+    def max_values(self):
+        return self.generator.max_values()
@@ -1,12 +1,53 @@
 import numpy as np
-import heapq
 
-class Servers:
-    def __init__(self, n_servers, air_vol_heatcap, R):
+from dc.jobs import JobQueue
+from dc.kernel import fan_power
+from dc.state import StateBuffer
+
+def least_loaded(load, n_jobs):
+    """
+    Spread jobs over the least loaded servers, one per server in order of increasing load and wrapping around
+    if there are more jobs than servers. load is (n_envs, n) with n_jobs[i] jobs going to row i, returns the
+    server index within the row for all jobs ordered by row.
+    """
+    n_jobs = np.asarray(n_jobs)
+    k = min(np.max(n_jobs, initial=0), load.shape[-1])
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    elif k == 1:
+        order = np.argmin(load, axis=-1)[:, None]
+    else:
+        order = np.argsort(load, axis=-1, kind="stable")[:, :k]
+    env = np.repeat(np.arange(len(load)), n_jobs)
+    rank = np.arange(len(env)) - np.repeat(np.cumsum(n_jobs) - n_jobs, n_jobs)
+    return order[env, rank % k]
+
+class Servers(StateBuffer):
+    __slots__ = ["n_servers", "air_vol_heatcap", "R", "n_envs", "shape", "idle_load", "max_load", "idle_temp_cpu", "max_temp_cpu",
+                 "target_temp_cpu", "min_flow", "max_flow", "Ti", "max_fan_power", "running_jobs", "index"]
+    # State kept in the buffer and saved by DCEnv.get_state_snapshot, the running jobs are saved separately
+    state_attributes = ["delta_t", "temp_cpu", "flow", "load", "fan_power", "dropped_jobs", "overheated_inlets"]
+
+    def __init__(self, n_servers, air_vol_heatcap, R, n_envs=None, dtype=np.float64, index=None):
         self.n_servers = n_servers
         self.air_vol_heatcap = air_vol_heatcap
         self.R = R
 
+        # With n_envs set every array gets a leading env dimension, one row per datacenter
+        self.n_envs = n_envs
+        self.shape = (n_servers,) if n_envs is None else (n_envs, n_servers)
+        # Optional dc.placement.PlacementIndex over the load, kept up to date by update_jobs
+        self.index = index
+        self.allocate({
+            "delta_t": (dtype, self.shape),
+            "temp_cpu": (dtype, self.shape),
+            "flow": (dtype, self.shape),
+            "load": (dtype, self.shape),
+            "fan_power": (dtype, self.shape[:-1]),
+            "dropped_jobs": (np.int64, self.shape[:-1]),
+            "overheated_inlets": (np.int64, self.shape[:-1]),
+        })
+
         self.idle_load = 50 
         self.max_load = 400  # W
         self.idle_temp_cpu = 35
@@ -22,39 +63,126 @@ class Servers:
         self.max_fan_power = 25.2 * 2 
 
     def reset(self, ambient_temp):
-        self.delta_t = np.zeros(self.n_servers)
-        self.temp_cpu = ambient_temp * np.ones(self.n_servers)
-        self.flow = self.min_flow * np.ones(self.n_servers)
-        self.load = self.idle_load * np.ones(self.n_servers)
+        # Assignments write into the state buffer
+        self.delta_t = 0
+        self.temp_cpu = ambient_temp
+        self.flow = self.min_flow
+        self.load = self.idle_load
 
-        self.fan_power = np.sum(self.max_fan_power * (self.flow / self.max_flow)**3)
+        self.fan_power = fan_power(self.flow, self.max_flow, self.max_fan_power)
 
-        self.running_jobs = []
+        self.running_jobs = JobQueue()
         self.dropped_jobs = 0
         self.overheated_inlets = 0
 
+        if self.index is not None:
+            self.index.build(self.load)
+
+    def reset_at(self, index, ambient_temp):
+        """
+        Reset a single datacenter (row index) when running batched
+        """
+        self.delta_t[index] = 0
+        self.temp_cpu[index] = ambient_temp
+        self.flow[index] = self.min_flow
+        self.load[index] = self.idle_load
+
+        self.fan_power = fan_power(self.flow, self.max_flow, self.max_fan_power)
+
+        self.running_jobs.discard(index * self.n_servers, (index + 1) * self.n_servers)
+        self.dropped_jobs[index] = 0
+        self.overheated_inlets[index] = 0
+
     def update(self, time, dt, placement, load, duration, temp_in):
-        # Update server in correct order
-        new_temp_cpu = temp_in + self.R * self.load / self.flow
+        # Update server in correct order, in place so everything reading the old flow and temp_cpu goes first
         delta_flow = dt / self.Ti * (self.target_temp_cpu - self.temp_cpu)
-        new_flow = np.clip(self.flow + delta_flow, self.min_flow, self.max_flow)
+        np.divide(self.load, self.air_vol_heatcap * self.flow, out=self.delta_t)
+        np.add(temp_in, self.R * self.load / self.flow, out=self.temp_cpu)
+        np.clip(self.flow + delta_flow, self.min_flow, self.max_flow, out=self.flow)
 
-        self.delta_t = self.load / (self.air_vol_heatcap * self.flow)
-
-        self.temp_cpu = new_temp_cpu
-        self.flow = new_flow
-        self.overheated_inlets = np.sum(temp_in > 27)
+        self.overheated_inlets = np.sum(temp_in > 27, axis=-1)
         
-        self.fan_power = np.sum(self.max_fan_power * (self.flow / self.max_flow)**3)
+        self.fan_power = fan_power(self.flow, self.max_flow, self.max_fan_power)
 
-        self.dropped_jobs = 0
-        if load == 0:
-            pass # No job
-        elif self.load[placement] + load <= self.max_load:
-            self.load[placement] += load
-            heapq.heappush(self.running_jobs, (time + duration, load, placement))
+        return self.update_jobs(time, dt, placement, load, duration)
+
+    def update_jobs(self, time, dt, placement, load, duration):
+        """
+        Start the new jobs and retire the finished ones, returns how many did either (the load changed if > 0)
+        """
+        step = int(round(time / dt))
+        started = self.start_jobs(step, dt, placement, load, duration)
+        finished = self.running_jobs.pop(step, self.load.reshape(-1))
+        if self.index is not None:
+            self.index.update(np.concatenate([started, finished]))
+        return len(started) + len(finished)
+
+    def n_running(self):
+        """
+        Number of running jobs, per datacenter when batched
+        """
+        if self.n_envs is None:
+            return len(self.running_jobs)
+        return np.bincount(self.running_jobs.placements() // self.n_servers, minlength=self.n_envs)
+
+    def start_jobs(self, step, dt, placement, load, duration):
+        """
+        Place a batch of jobs, placement is the flat index into load (env * n_servers + server when batched).
+        Jobs taking a server above max_load are dropped, the earlier started jobs of the batch on the same server count.
+        Returns the placement of the started jobs.
+        """
+        placement, load, duration = np.atleast_1d(placement, load, duration)
+        if len(load) <= 1:
+            return self.start_job(step, dt, placement, load, duration)
+        jobs = load > 0 # Zero load means no job
+        placement, load, duration = placement[jobs], load[jobs], duration[jobs]
+
+        # Jobs of the batch on the same server end up next to each other, in their original order
+        order = np.argsort(placement, kind="stable")
+        placement, load, duration = placement[order], load[order], duration[order]
+
+        flat_load = self.load.reshape(-1)
+        fits = flat_load[placement] + load <= self.max_load
+
+        # Servers getting several jobs are filled one job at a time, a dropped job leaves room for the later ones
+        same = placement[1:] == placement[:-1]
+        if np.any(same):
+            shared = np.zeros(len(placement), dtype=bool)
+            shared[1:] |= same
+            shared[:-1] |= same
+            server_load = {}
+            for i in np.flatnonzero(shared):
+                current = server_load.get(placement[i], flat_load[placement[i]])
+                fits[i] = current + load[i] <= self.max_load
+                if fits[i]:
+                    server_load[placement[i]] = current + load[i]
+        np.add.at(flat_load, placement[fits], load[fits])
+        end = np.ceil(np.round(step + duration[fits] / dt, 6)).astype(np.int64)
+        self.running_jobs.push(end, load[fits], placement[fits])
+
+        if self.n_envs is None:
+            self.dropped_jobs = np.sum(~fits)
+        else:
+            self.dropped_jobs = np.bincount(placement[~fits] // self.n_servers, minlength=self.n_envs)
+        return placement[fits]
+
+    def start_job(self, step, dt, placement, load, duration):
+        """
+        start_jobs for at most one job, the common case of one arrival per tick, with scalar operations
+        """
+        flat_load = self.load.reshape(-1)
+        dropped = False
+        if len(load) == 1 and load[0] > 0:
+            if flat_load[placement[0]] + load[0] <= self.max_load:
+                flat_load[placement[0]] += load[0]
+                self.running_jobs.push_one(int(np.ceil(np.round(step + duration[0] / dt, 6))), load[0], placement[0])
+            else:
+                dropped = True
+
+        if self.n_envs is None:
+            self.dropped_jobs = int(dropped)
         else:
-            self.dropped_jobs = 1
-        while len(self.running_jobs) > 0 and self.running_jobs[0][0] <= time:
-            _, load, placement = heapq.heappop(self.running_jobs)
-            self.load[placement] -= load
+            self.dropped_jobs = 0
+            if dropped:
+                self.dropped_jobs[placement[0] // self.n_servers] = 1
+        return placement[:0] if dropped or len(load) == 0 or load[0] <= 0 else placement
@@ -0,0 +1,215 @@
+import copy
+import multiprocessing as mp
+import os
+import warnings
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from dc.dc import DCEnv
+from dc.servers import Servers
+from dc.jobs import JobQueue
+
+# Per server state of Servers and SimpleFlow, workers own a slice of these
+SERVER_FIELDS = ["delta_t", "temp_cpu", "flow", "load"]
+FLOW_FIELDS = ["server_temp_in", "server_temp_out"]
+
+class ShardedDCEnv(DCEnv):
+    """
+    One datacenter with its racks split over shards worker processes. The state of the servers and the flow
+    model lives in shared memory and every worker updates the servers of its racks in place, including placing
+    and retiring their jobs. Per tick only the flow totals and the summed costs of every shard come back, the
+    main process mixes the air, updates the CRAH units and places the next jobs on the shared load.
+
+    Only the simple flow model couples the servers through totals alone, so spatial flow and the numba backend
+    are not supported. Sums are added up per shard, results differ from DCEnv by rounding unless shards is 1.
+    Call close when done to stop the workers, forks start workers of their own and need it as well.
+    """
+    def __init__(self, config={}):
+        DCEnv.__init__(self, config)
+        self.config = config # For fork
+        assert self.flow_model == "simple", "Sharding needs the simple flow model"
+        if self.backend != "numpy":
+            warnings.warn("ShardedDCEnv runs the numpy backend in its workers")
+            self.backend = "numpy"
+        if self.servers.index is not None:
+            warnings.warn("The placement index is not kept up to date across shards, placing with least_loaded")
+            self.servers.index = None
+            self.placement = "least_loaded"
+
+        # Contiguous racks per shard, as server ranges
+        n_shards = min(config.get("shards", os.cpu_count()), self.flowsim.n_racks)
+        racks = np.array_split(np.arange(self.flowsim.n_racks), n_shards)
+        self.bounds = np.array([r[0] for r in racks] + [self.flowsim.n_racks]) * self.flowsim.servers_per_rack
+
+        # Both state buffers in one shared block, the flow buffer aligned after the servers
+        flow_offset = -(-self.servers.state.nbytes // 64) * 64
+        self.shm = shared_memory.SharedMemory(create=True, size=flow_offset + self.flowsim.state.nbytes)
+        self.servers.share(self.shm.buf, 0)
+        self.flowsim.share(self.shm.buf, flow_offset)
+        layout = (self.servers.state.dtype, self.flowsim.state.dtype, flow_offset)
+
+        self.connections = []
+        self.workers = []
+        for start, stop in zip(self.bounds[:-1], self.bounds[1:]):
+            connection, worker_connection = mp.Pipe()
+            worker = mp.Process(target=shard_worker, daemon=True, args=(
+                worker_connection, self.shm.name, layout, start, stop, self.servers.air_vol_heatcap, self.servers.R, self.state_dtype))
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def reset(self):
+        for connection in self.connections:
+            connection.send(("reset",))
+        for connection in self.connections:
+            connection.recv()
+        state = DCEnv.reset(self)
+        self.servers.running_jobs = ShardedJobs(self)
+        return state
+
+    def update_parts(self, placement, load, duration, crah_temp, crah_flow):
+        shard = np.searchsorted(self.bounds, placement, side="right") - 1
+        for i, connection in enumerate(self.connections):
+            jobs = shard == i
+            connection.send(("tick", self.time, self.dt, placement[jobs] - self.bounds[i], load[jobs], duration[jobs]))
+
+        # The CRAH only needs the previous inlet temperature, update it while the workers run
+        self.crah.update(crah_temp, crah_flow, self.flowsim.crah_temp_in, self.ambient_temp(self.time))
+
+        totals = np.array([connection.recv() for connection in self.connections])
+        server_flow_total, heat_flow_total, fan_power, overheated_inlets, dropped_jobs, changed_jobs, running_jobs = np.sum(totals, axis=0)
+        self.servers.running_jobs.count = int(running_jobs)
+        self.servers.fan_power = fan_power
+        self.servers.overheated_inlets = overheated_inlets
+        self.servers.dropped_jobs = dropped_jobs
+        self.flowsim.mix(server_flow_total, heat_flow_total, self.crah)
+        return int(changed_jobs)
+
+    def set_state_snapshot(self, snapshot, copy=True):
+        # The state buffers are shared so the parts are restored in place, the jobs go back to their shards
+        DCEnv.set_state_snapshot(self, snapshot, copy)
+        jobs = self.servers.running_jobs.get_state()
+        self.servers.running_jobs = ShardedJobs(self)
+        self.servers.running_jobs.set_state(jobs)
+
+    def fork(self):
+        """
+        A new ShardedDCEnv with the same config and shards, restored to the current state. Like DCEnv.fork it
+        records nothing and keeps its metrics in memory, but it runs its own workers, so close it when done.
+        """
+        config = dict(self.config, shards=len(self.connections), record_path=None)
+        config["metrics"] = {name: value for name, value in self.metrics_config.items() if name in ("signals", "decimation", "capacity")}
+        config["load_generator"] = copy.copy(self.load_generator)
+        if hasattr(self.load_generator, "rng"):
+            config["load_generator"].rng = np.random.default_rng() # State comes from the snapshot
+        env = ShardedDCEnv(config)
+        env.reset()
+        env.set_state_snapshot(self.get_state_snapshot(), copy=False)
+        return env
+
+    def close(self):
+        DCEnv.close(self)
+        for connection in self.connections:
+            connection.send(("close",))
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+        # Drop the views into the block before releasing it
+        self.servers.state = self.servers.state.copy()
+        self.servers.views = {name: self.servers.state[name] for name in self.servers.state_attributes}
+        self.flowsim.state = self.flowsim.state.copy()
+        self.flowsim.views = {name: self.flowsim.state[name] for name in self.flowsim.state_attributes}
+        self.shm.close()
+        self.shm.unlink()
+
+class ShardedJobs:
+    """
+    Stands in for the JobQueue of the main process, the running jobs are kept by the workers of their shard.
+    Their number comes back with every tick, so len needs no round trip.
+    """
+    def __init__(self, env):
+        self.env = env
+        self.count = 0
+
+    def request(self, *message):
+        for connection in self.env.connections:
+            connection.send(message)
+        return [connection.recv() for connection in self.env.connections]
+
+    def __len__(self):
+        return self.count
+
+    def next_end(self):
+        ends = [end for end in self.request("next_end") if end is not None]
+        return min(ends) if ends else None
+
+    def placements(self):
+        return np.concatenate([placement + start for placement, start in zip(self.request("placements"), self.env.bounds)])
+
+    def get_state(self):
+        states = self.request("get_state")
+        state = {name: np.concatenate([s[name] for s in states]) for name in ["end", "load", "placement"]}
+        state["placement"] = np.concatenate([s["placement"] + start for s, start in zip(states, self.env.bounds)])
+        state["step"] = states[0]["step"]
+        return state
+
+    def set_state(self, state):
+        shard = np.searchsorted(self.env.bounds, state["placement"], side="right") - 1
+        for i, connection in enumerate(self.env.connections):
+            jobs = shard == i
+            connection.send(("set_state", {
+                "end": state["end"][jobs],
+                "load": state["load"][jobs],
+                "placement": state["placement"][jobs] - self.env.bounds[i],
+                "step": state["step"],
+            }))
+        for connection in self.env.connections:
+            connection.recv()
+        self.count = len(state["end"])
+
+def shard_worker(connection, name, layout, start, stop, air_vol_heatcap, R, dtype):
+    """
+    Owns the servers [start, stop), their state are slices of the shared buffers and their jobs a local queue
+    """
+    servers_dtype, flow_dtype, flow_offset = layout
+    shm = shared_memory.SharedMemory(name=name)
+    servers_state = np.ndarray((), dtype=servers_dtype, buffer=shm.buf)
+    flow_state = np.ndarray((), dtype=flow_dtype, buffer=shm.buf, offset=flow_offset)
+
+    servers = Servers(stop - start, air_vol_heatcap, R, dtype=dtype)
+    servers.bind({name: servers_state[name][start:stop] for name in SERVER_FIELDS})
+    servers.running_jobs = JobQueue()
+    server_temp_in, server_temp_out = (flow_state[name][start:stop] for name in FLOW_FIELDS)
+
+    while True:
+        message = connection.recv()
+        command = message[0]
+        if command == "tick":
+            # Servers.update then the per server part of SimpleFlow.step
+            time, dt, placement, load, duration = message[1:]
+            changed_jobs = servers.update(time, dt, placement, load, duration, server_temp_in)
+            server_flow_total = np.sum(servers.flow)
+            heat_flow_total = np.sum(servers.flow * server_temp_out)
+            np.add(server_temp_in, servers.delta_t, out=server_temp_out)
+            connection.send((server_flow_total, heat_flow_total, servers.fan_power, servers.overheated_inlets, servers.dropped_jobs, changed_jobs, len(servers.running_jobs)))
+        elif command == "reset":
+            servers.running_jobs = JobQueue()
+            connection.send(None)
+        elif command == "next_end":
+            connection.send(servers.running_jobs.next_end())
+        elif command == "placements":
+            connection.send(servers.running_jobs.placements())
+        elif command == "get_state":
+            connection.send(servers.running_jobs.get_state())
+        elif command == "set_state":
+            servers.running_jobs = JobQueue()
+            servers.running_jobs.set_state(message[1])
+            connection.send(None)
+        elif command == "close":
+            break
+
+    # Views into the block have to go before it can be closed
+    del servers, servers_state, flow_state, server_temp_in, server_temp_out
+    shm.close()
@@ -1,7 +1,13 @@
 import numpy as np
 
-class SimpleFlow:
-    def __init__(self, dt, n_servers=360, n_racks=12, n_crah=4):
+from dc.state import StateBuffer
+
+class SimpleFlow(StateBuffer):
+    __slots__ = ["n_servers", "n_racks", "servers_per_rack", "n_crah", "dt", "n_envs", "batch_shape"]
+    # State kept in the buffer and saved by DCEnv.get_state_snapshot
+    state_attributes = ["server_temp_in", "server_temp_out", "crah_temp_in"]
+
+    def __init__(self, dt, n_servers=360, n_racks=12, n_crah=4, n_envs=None, dtype=np.float64):
         self.n_servers = n_servers
         self.n_racks = n_racks
         assert self.n_servers % self.n_racks == 0, "Servers not divisible into racks"
@@ -9,25 +15,58 @@ class SimpleFlow:
         self.n_crah = n_crah
         self.dt = dt
 
+        # With n_envs set every array gets a leading env dimension, one row per datacenter
+        self.n_envs = n_envs
+        self.batch_shape = () if n_envs is None else (n_envs,)
+        self.allocate({
+            "server_temp_in": (dtype, self.batch_shape + (n_servers,)),
+            "server_temp_out": (dtype, self.batch_shape + (n_servers,)),
+            "crah_temp_in": (dtype, self.batch_shape + (n_crah,)),
+        })
+
     def reset(self, servers, crah):
-        self.server_temp_in = np.zeros(self.n_servers)
-        self.server_temp_out = np.zeros(self.n_servers)
-        self.crah_temp_in = np.zeros(self.n_crah)
+        self.server_temp_in = 0
+        self.server_temp_out = 0
+        self.crah_temp_in = 0
+
+    def reset_at(self, index, servers, crah):
+        self.server_temp_in[index] = 0
+        self.server_temp_out[index] = 0
+        self.crah_temp_in[index] = 0
 
     def step(self, servers, crah):
         # This is a step of dt and then the new values are read
+        if self.n_envs is None:
+            server_flow_total = np.sum(servers.flow)
+            heat_flow_total = np.sum(servers.flow * self.server_temp_out)
+        else:
+            # Totals keep a trailing axis to broadcast over the servers of every datacenter
+            server_flow_total = np.sum(servers.flow, axis=-1, keepdims=True)
+            heat_flow_total = np.sum(servers.flow * self.server_temp_out, axis=-1, keepdims=True)
 
-        server_flow_total = np.sum(servers.flow)
-        crah_flow_total = np.sum(crah.flow)
-
-        prev_server_temp_out_avg = np.dot(servers.flow, self.server_temp_out) / server_flow_total
+        # All updated based on previous values
+        np.add(self.server_temp_in, servers.delta_t, out=self.server_temp_out)
+        self.mix(server_flow_total, heat_flow_total, crah)
 
-        recirculation = max(0, 1 - crah_flow_total / server_flow_total) 
-        bypass = max(0, 1 - server_flow_total / crah_flow_total)
+    def mix(self, server_flow_total, heat_flow_total, crah):
+        """
+        Inlet temperatures from the server flow and flow weighted outlet temperature totals, the only place the
+        servers are coupled. Split from step so sharded runs can add up the totals of every shard first.
+        """
+        prev_server_temp_out_avg = heat_flow_total / server_flow_total
 
-        prev_crah_temp_out = crah.temp_out[0] # Simple model has same temp out
+        # A single datacenter works on scalars, which is quicker than the batched arrays of one element
+        if self.n_envs is None:
+            crah_flow_total = np.sum(crah.flow)
+            recirculation = max(0, 1 - crah_flow_total / server_flow_total)
+            bypass = max(0, 1 - server_flow_total / crah_flow_total)
+            prev_crah_temp_out = crah.temp_out[0] # Simple model has same temp out
+        else:
+            crah_flow_total = np.sum(crah.flow, axis=-1, keepdims=True)
+            recirculation = np.maximum(0, 1 - crah_flow_total / server_flow_total)
+            bypass = np.maximum(0, 1 - server_flow_total / crah_flow_total)
+            prev_crah_temp_out = crah.temp_out[..., :1]
 
-        # All updated based on previous values
-        self.server_temp_out = self.server_temp_in + servers.delta_t
-        self.server_temp_in = ((1 - recirculation) * prev_crah_temp_out + recirculation * prev_server_temp_out_avg) * np.ones(self.n_servers)
-        self.crah_temp_in = ((1 - bypass) * prev_server_temp_out_avg + bypass * prev_crah_temp_out) * np.ones(self.n_crah)
\ No newline at end of file
+        # Assigning broadcasts over the servers/CRAH units
+        self.server_temp_in = (1 - recirculation) * prev_crah_temp_out + recirculation * prev_server_temp_out_avg
+        self.crah_temp_in = (1 - bypass) * prev_server_temp_out_avg + bypass * prev_crah_temp_out
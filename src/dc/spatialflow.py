@@ -0,0 +1,95 @@
+import numpy as np
+
+from dc.simpleflow import SimpleFlow
+
+class SparseMatrix:
+    """
+    Minimal CSR matrix, dot does one gather, multiply and segmented sum so the cost is linear in the nonzeros.
+    Every row needs at least one entry since empty segments break np.add.reduceat.
+    """
+    def __init__(self, rows, cols, values, shape):
+        order = np.lexsort((cols, rows))
+        self.rows = np.asarray(rows)[order]
+        self.cols = np.asarray(cols)[order]
+        self.values = np.asarray(values, dtype=float)[order]
+        self.shape = shape
+        counts = np.bincount(self.rows, minlength=shape[0])
+        assert np.all(counts > 0), "Every row needs a nonzero"
+        self.indptr = np.concatenate([[0], np.cumsum(counts)])
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    def dot(self, x):
+        """
+        Product with x along its last axis, leading axes (envs, stacked vectors) are kept
+        """
+        return np.add.reduceat(x[..., self.cols] * self.values, self.indptr[:-1], axis=-1)
+
+    def todense(self):
+        dense = np.zeros(self.shape)
+        np.add.at(dense, (self.rows, self.cols), self.values)
+        return dense
+
+class SpatialFlow(SimpleFlow):
+    """
+    Flow model with the racks in one row and the CRAH units spread evenly along it, each cooling a contiguous
+    zone of racks. Within a zone the CRAH/server flow mismatch decides how much air recirculates (CRAH flow too
+    low) or bypasses the servers (CRAH flow too high), like SimpleFlow but per CRAH. Recirculated air reaching
+    a server inlet is the exhaust of its neighbours, given by a sparse matrix over servers within reach slots
+    in the same and adjacent racks. Servers higher up in a rack get more of it.
+
+    Only the step differs from SimpleFlow, every step is a few sparse products so it scales with the number of servers.
+    """
+    __slots__ = ["zone", "zones", "recirculation", "height"]
+
+    def __init__(self, dt, n_servers=360, n_racks=12, n_crah=4, n_envs=None, dtype=np.float64, reach=2, decay=1.0, height_factor=0.5):
+        super().__init__(dt, n_servers, n_racks, n_crah, n_envs, dtype)
+        assert self.n_crah <= self.n_racks, "Every CRAH needs at least one rack"
+
+        server = np.arange(n_servers)
+        rack = server // self.servers_per_rack
+        slot = server % self.servers_per_rack
+
+        # Contiguous zones of racks per CRAH
+        self.zone = rack * n_crah // n_racks
+        self.zones = SparseMatrix(self.zone, server, np.ones(n_servers), (n_crah, n_servers))
+
+        # Recirculation from servers within reach slots, in the same rack or the ones next to it,
+        # weighted by exp(-decay * distance) with a rack counting as one slot
+        rows, cols, values = [], [], []
+        for drack in (-1, 0, 1):
+            for dslot in range(-reach, reach + 1):
+                source_rack, source_slot = rack + drack, slot + dslot
+                valid = (source_rack >= 0) & (source_rack < n_racks) & (source_slot >= 0) & (source_slot < self.servers_per_rack)
+                rows.append(server[valid])
+                cols.append(source_rack[valid] * self.servers_per_rack + source_slot[valid])
+                values.append(np.full(np.sum(valid), np.exp(-decay * (abs(drack) + abs(dslot)))))
+        self.recirculation = SparseMatrix(np.concatenate(rows), np.concatenate(cols), np.concatenate(values), (n_servers, n_servers))
+
+        # Share of the zone recirculation per server, from 1 - height_factor at the bottom to 1 + height_factor at the top
+        height = slot / max(self.servers_per_rack - 1, 1)
+        self.height = 1 + height_factor * (2 * height - 1)
+
+    def step(self, servers, crah):
+        # This is a step of dt and then the new values are read
+        heat_flow = servers.flow * self.server_temp_out
+
+        # Zone totals, (..., n_crah)
+        zone_flow, zone_heat_flow = self.zones.dot(np.stack([servers.flow, heat_flow], axis=-2)).swapaxes(0, -2)
+        prev_zone_temp_out_avg = zone_heat_flow / zone_flow
+        recirculation = np.maximum(0, 1 - crah.flow / zone_flow)
+        bypass = np.maximum(0, 1 - zone_flow / crah.flow)
+
+        # Flow weighted exhaust temperature reaching every inlet, (..., n_servers)
+        near_flow, near_heat_flow = self.recirculation.dot(np.stack([servers.flow, heat_flow], axis=-2)).swapaxes(0, -2)
+        prev_recirculated_temp = near_heat_flow / near_flow
+
+        server_recirculation = np.minimum(1, recirculation[..., self.zone] * self.height)
+        prev_crah_temp_out = crah.temp_out
+
+        # All updated based on previous values
+        np.add(self.server_temp_in, servers.delta_t, out=self.server_temp_out)
+        self.server_temp_in = (1 - server_recirculation) * prev_crah_temp_out[..., self.zone] + server_recirculation * prev_recirculated_temp
+        self.crah_temp_in = (1 - bypass) * prev_zone_temp_out_avg + bypass * prev_crah_temp_out
@@ -0,0 +1,56 @@
+import numpy as np
+
+class StateBuffer:
+    """
+    Base for the simulator parts. The attributes in state_attributes live in one preallocated structured numpy
+    buffer (self.state, a single record with one contiguous array per attribute) and are exposed as views.
+    Assigning to them writes into the buffer, so the existing update code works in place and the whole state
+    of a part is one block that can be copied or shared. Subclasses use __slots__ for everything else.
+    """
+    __slots__ = ["state", "views"]
+    state_attributes = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in cls.__dict__.get("state_attributes", []):
+            setattr(cls, name, state_property(name))
+
+    def allocate(self, fields):
+        """
+        Allocate the buffer, fields maps every name in state_attributes to its (dtype, shape)
+        """
+        self.state = np.zeros((), dtype=np.dtype([(name, *fields[name]) for name in self.state_attributes]))
+        self.views = {name: self.state[name] for name in self.state_attributes}
+
+    def share(self, buffer, offset=0):
+        """
+        Move the state into buffer (e.g. the buf of a SharedMemory) at offset, keeping its values
+        """
+        state = np.ndarray((), dtype=self.state.dtype, buffer=buffer, offset=offset)
+        state[...] = self.state
+        self.state = state
+        self.views = {name: self.state[name] for name in self.state_attributes}
+
+    def bind(self, views):
+        """
+        Point state attributes at outside arrays of the same shape, e.g. slices of another part's shared buffer
+        """
+        self.views.update(views)
+
+    def __copy__(self):
+        # A copy gets its own buffer, everything else is shared
+        other = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", []):
+                if hasattr(self, name):
+                    setattr(other, name, getattr(self, name))
+        other.state = self.state.copy()
+        other.views = {name: other.state[name] for name in self.state_attributes}
+        return other
+
+def state_property(name):
+    def get(self):
+        return self.views[name]
+    def set(self, value):
+        self.views[name][...] = value
+    return property(get, set)
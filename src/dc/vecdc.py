@@ -0,0 +1,241 @@
+import functools
+import warnings
+
+import numpy as np
+
+from dc.dc import DCEnv
+from dc.servers import Servers, least_loaded
+from dc.crah import CRAH
+from dc.schedule import PrefetchedArrival
+
+class VecDCEnv(DCEnv):
+    """
+    Runs num_envs independent datacenters in lock-step. All state is kept as (num_envs, n_servers) and
+    (num_envs, n_crah) arrays so one step moves every datacenter forward in a single numpy pass.
+
+    Implements the rllib VectorEnv interface without importing ray, register rllib_vec_env with tune to
+    get an actual VectorEnv. Use with num_envs_per_worker = 1 since the batching is done here.
+    """
+    state_attributes = DCEnv.state_attributes + ["clock"]
+
+    def __init__(self, config={}):
+        DCEnv.__init__(self, config)
+        self.num_envs = config.get("num_envs", 16)
+        if self.placement_index:
+            warnings.warn("The placement index is only used by DCEnv, VecDCEnv places with least_loaded")
+            self.placement = "least_loaded"
+        if self.substeps != 1:
+            warnings.warn("control_interval is only used by DCEnv, VecDCEnv steps the physics once per action")
+            self.substeps = 1
+        if self.fast_forward:
+            warnings.warn("fast_forward is only used by DCEnv, VecDCEnv runs the physics on every step")
+            self.fast_forward = False
+        if self.backend != "numpy":
+            warnings.warn(f"The {self.backend} backend is only used by DCEnv, VecDCEnv runs the numpy backend")
+            self.backend = "numpy"
+
+        self.flowsim = self.make_flowsim(self.n_servers, self.flowsim.n_racks, self.n_crah, n_envs=self.num_envs)
+        self.servers = Servers(self.n_servers, self.servers.air_vol_heatcap, self.servers.R, n_envs=self.num_envs, dtype=self.state_dtype)
+        self.crah = CRAH(self.n_crah, self.crah.air_vol_heatcap, n_envs=self.num_envs, dtype=self.state_dtype)
+
+        # Separate prefetched jobs per env, they draw their blocks from the same generator unless load_generators
+        # gives one per env (e.g. one seed per env)
+        generators = config.get("load_generators", [self.load_generator] * self.num_envs)
+        self.arrivals = [PrefetchedArrival(generator, self.dt, self.prefetch) for generator in generators]
+
+        self.allocate_buffers((self.num_envs,))
+
+    def vector_reset(self):
+        self.rng = np.random.default_rng(self.seed)
+
+        self.time = np.zeros(self.num_envs)
+        self.clock = 0 # Shared clock for the job queue, time is per env since they can be reset individually
+
+        ambient_temp = self.get_ambient_temp()
+        self.servers.reset(ambient_temp)
+        self.crah.reset(ambient_temp)
+
+        self.flowsim.reset(self.servers, self.crah)
+
+        self.update_costs()
+
+        self.jobs = [None] * self.num_envs
+        for arrivals in self.arrivals:
+            arrivals.clear()
+        self.next_jobs()
+
+        if self.recorder is not None:
+            self.recorder.reset()
+
+        return self.vector_get_state()
+
+    def reset_at(self, index):
+        self.time[index] = 0
+
+        ambient_temp = self.ambient_temp(self.time[index])
+        self.servers.reset_at(index, ambient_temp)
+        self.crah.reset_at(index, ambient_temp)
+
+        self.flowsim.reset_at(index, self.servers, self.crah)
+
+        self.update_costs()
+
+        self.arrivals[index].clear()
+        self.next_jobs(index)
+
+        return self.vector_get_state()[index]
+
+    def vector_step(self, actions):
+        # Same default actions as DCEnv during pretraining, envs reset at different times leave it row by row
+        pretrain = self.time < self.pretrain_timesteps
+        if np.all(pretrain):
+            actions, pretrain = [()] * self.num_envs, None
+        elif not np.any(pretrain):
+            pretrain = None
+
+        # Stack each action component over envs and clip/rescale them all at once
+        action = self.decode_action([np.array(a).reshape(self.num_envs, -1) for a in zip(*actions)])
+        return self.vector_step_env(action, pretrain)
+
+    def vector_step_env(self, action, default=None):
+        """
+        Step all envs with an action already in env units, a dict of (num_envs, k) arrays by action name as
+        decode_action returns it. Missing entries take the defaults and envs with a negative server are placed
+        with least_loaded, so scripted controllers can mix placement policies in one batch. default is an
+        optional mask of envs that take the default actions whatever action holds.
+        """
+        # Jobs of all envs in one flat batch, env holds the env index of every job
+        load = np.concatenate([job[0] for job in self.jobs])
+        duration = np.concatenate([job[1] for job in self.jobs])
+        n_jobs = np.array([len(job[0]) for job in self.jobs])
+        envs = np.arange(self.num_envs)
+        env = np.repeat(envs, n_jobs)
+        if "slot" in action:
+            placement = action["rack"][env, 0] * self.flowsim.servers_per_rack + action["slot"][env, 0]
+        elif "rack" in action:
+            rack_placement = action["rack"][:, 0]
+            rack_load = self.servers.load.reshape(self.num_envs, self.flowsim.n_racks, self.flowsim.servers_per_rack)[envs, rack_placement]
+            placement = rack_placement[env] * self.flowsim.servers_per_rack + least_loaded(rack_load, n_jobs)
+        elif "candidate" in action:
+            placement = self.candidates[env, action["candidate"][env, 0]]
+        elif "server" in action:
+            placement = action["server"][env, 0]
+            negative = placement < 0
+            if np.any(negative):
+                placement[negative] = least_loaded(self.servers.load[:, :self.n_place], n_jobs)[negative]
+        else:
+            placement = least_loaded(self.servers.load[:, :self.n_place], n_jobs)
+        if default is not None:
+            # Envs taking the defaults place like DCEnv without a placement action
+            jobs = default[env]
+            placement[jobs] = least_loaded(self.servers.load[:, :self.n_place], n_jobs)[jobs]
+
+        self.time += self.dt
+        self.clock += self.dt
+
+        self.servers.update(self.clock, self.dt, env * self.n_servers + placement, load, duration, self.flowsim.server_temp_in)
+
+        # Update CRAH fans
+        crah_temp = action.get("crah_out", self.crah_out_setpoint)
+        crah_flow = action.get("crah_flow", self.crah_flow_setpoint * self.crah.max_flow)
+        if default is not None:
+            crah_temp = np.where(default[:, None], self.crah_out_setpoint, crah_temp)
+            crah_flow = np.where(default[:, None], self.crah_flow_setpoint * self.crah.max_flow, crah_flow)
+        self.crah.update(crah_temp, crah_flow, self.flowsim.crah_temp_in, self.get_ambient_temp())
+
+        # Run simulation based on current boundary condition
+        self.flowsim.step(self.servers, self.crah)
+
+        # Get new jobs, arrays of expected load and duration per env
+        self.next_jobs()
+
+        self.update_costs()
+        total_cost = self.total_energy_cost + self.total_job_drop_cost + self.total_overheat_cost
+        reward = -total_cost
+
+        if self.metrics.enabled:
+            self.metrics.record(self)
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+        return self.vector_get_state(), list(reward), [False] * self.num_envs, [{} for _ in range(self.num_envs)]
+
+    def get_unwrapped(self):
+        return [_EnvView(self, i) for i in range(self.num_envs)]
+
+    def get_ambient_temp(self):
+        """
+        Ambient temperature for all envs as a column to broadcast against (num_envs, n) arrays
+        """
+        return (self.ambient_temp(self.time) * np.ones(self.num_envs))[:, None]
+
+    def next_jobs(self, index=None):
+        """
+        Draw the jobs arriving during the next step for all envs, or only the one at index
+        """
+        for i in range(self.num_envs) if index is None else [index]:
+            load, duration = map(np.atleast_1d, self.arrivals[i](self.time[i]))
+            jobs = load > 0 # Zero load means no job
+            self.jobs[i] = (load[jobs], duration[jobs])
+        self.job_buffer[:] = [(np.sum(load), np.mean(duration) if len(load) > 0 else 0) for load, duration in self.jobs]
+        self.job_state = self.job_buffer
+
+    def update_costs(self):
+        total_energy = (self.servers.fan_power + self.crah.fan_power + self.crah.compressor_power) * self.dt
+        self.total_energy_cost = self.energy_cost * total_energy
+        self.total_job_drop_cost = self.job_drop_cost * self.servers.dropped_jobs
+        self.total_overheat_cost = self.overheat_cost * self.servers.overheated_inlets
+
+    def arrival_schedules(self):
+        return self.arrivals
+
+    def get_jobs_snapshot(self):
+        return {
+            "job/load": np.concatenate([job[0] for job in self.jobs]),
+            "job/duration": np.concatenate([job[1] for job in self.jobs]),
+            "job/count": np.array([len(job[0]) for job in self.jobs]),
+        }
+
+    def set_jobs_snapshot(self, snapshot):
+        split = np.cumsum(snapshot["job/count"])[:-1]
+        self.jobs = list(zip(np.split(np.array(snapshot["job/load"]), split), np.split(np.array(snapshot["job/duration"]), split)))
+
+    def vector_get_state(self):
+        """
+        Return a list with one observation per env
+        """
+        # get_state fills the (num_envs, size) buffer, split it into rows afterwards. Flat rows are views of a fresh copy.
+        state = self.get_state()
+        return list(state) if self.flatten_observations else list(zip(*state))
+
+@functools.lru_cache(maxsize=None)
+def rllib_vec_env_class():
+    from ray.rllib.env.vector_env import VectorEnv
+    return type("RLlibVecDCEnv", (VecDCEnv, VectorEnv), {})
+
+def rllib_vec_env(config):
+    """
+    Env creator for tune.register_env, ray is only imported here so the simulation itself does not need it
+    """
+    return rllib_vec_env_class()(config)
+
+class _EnvView:
+    """
+    Read only view of a single env in a VecDCEnv, looks like a DCEnv for logging
+    """
+    def __init__(self, env, index):
+        self._env = env
+        self._index = index
+
+    def __getattr__(self, name):
+        value = getattr(self._env, name)
+        if name in ("servers", "crah", "flowsim"):
+            return _EnvView(value, self._index)
+        if name == "running_jobs":
+            placements = value.placements()
+            return placements[placements // self._env.n_servers == self._index]
+        if name == "metrics":
+            return value.at(self._index)
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            return value[self._index]
+        return value
@@ -0,0 +1,92 @@
+import argparse
+import copy
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+import loads
+import scriptutils
+from dc.vecdc import VecDCEnv
+from dc.controllers import CONTROLLERS, SERIES, run_controllers
+from scriptutils import SharedResults
+
+parser = argparse.ArgumentParser(description="Runs scripted controllers x seeds in lock-step over batched envs, one batch per process")
+parser.add_argument("--controllers", nargs="+", default=list(CONTROLLERS))
+parser.add_argument("--seeds", nargs="+", type=int, default=[37])
+parser.add_argument("--steps", type=int, default=10000)
+parser.add_argument("--avg_load", type=float, default=200)
+parser.add_argument("--arrival_rate", type=float, default=0) # 0 is one job per step as in main.py
+parser.add_argument("--ambient_offset", type=float, default=20)
+parser.add_argument("--ambient_amplitude", type=float, default=5)
+parser.add_argument("--n_servers", type=int, default=360)
+parser.add_argument("--n_racks", type=int, default=12)
+parser.add_argument("--n_crah", type=int, default=4)
+parser.add_argument("--flow_model", type=str, default="simple")
+parser.add_argument("--workers", type=int, default=mp.cpu_count())
+parser.add_argument("--output", type=str, default=None) # npz with one (controllers, seeds, steps) array per series
+args = parser.parse_args()
+
+def make_env(runs):
+    """
+    Batched env with one row per (controller, seed) run, every row gets its own job stream for its seed
+    """
+    dt = 1
+    load_generator = scriptutils.load_generator(args.avg_load, args.n_servers, args.arrival_rate, dt, seed=0)
+
+    generators = []
+    for _, seed in runs:
+        generator = copy.copy(load_generator)
+        if hasattr(generator, "rng"):
+            generator.rng = np.random.default_rng(seed)
+        generators.append(generator)
+
+    return VecDCEnv({
+        "dt": dt,
+        "num_envs": len(runs),
+        "n_servers": args.n_servers,
+        "n_racks": args.n_racks,
+        "n_crah": args.n_crah,
+        "n_place": args.n_servers,
+        "load_generator": load_generator,
+        "load_generators": generators,
+        "ambient_temp": loads.SinusTemperature(offset=args.ambient_offset, amplitude=args.ambient_amplitude),
+        "actions": ["server", "crah_out", "crah_flow"],
+        "flow_model": args.flow_model,
+        "metrics": {"signals": []}, # Only the series are kept
+    })
+
+def work(item):
+    """
+    Run a chunk of (controller, seed) runs as one batch, the series go straight into shared memory
+    """
+    indices, runs = item
+    env = make_env(runs)
+    # One controller object per name and chunk, it acts on all rows of its name at once
+    controllers = {name: CONTROLLERS[name]() for name, _ in runs}
+    series = run_controllers(env, [controllers[name] for name, _ in runs], args.steps)
+    for i, name in enumerate(SERIES):
+        scriptutils.results[i, indices] = series[name]
+    return len(runs)
+
+if __name__ == "__main__":
+    runs = [(name, seed) for name in args.controllers for seed in args.seeds]
+    workers = max(min(args.workers, len(runs)), 1)
+    chunks = [(indices, [runs[i] for i in indices]) for indices in np.array_split(np.arange(len(runs)), workers)]
+
+    with SharedResults((len(SERIES), len(runs), args.steps)) as results:
+        start = time.perf_counter()
+        with results.pool(workers) as pool:
+            done = 0
+            for n in pool.imap_unordered(work, chunks):
+                done += n
+                print(f"[{done}/{len(runs)}] runs done")
+        elapsed = time.perf_counter() - start
+        print(f"{len(runs)} runs x {args.steps} steps in {elapsed:.1f} s, {len(runs) * args.steps / elapsed:.0f} env steps/s")
+
+        series = {name: results.array[i].reshape(len(args.controllers), len(args.seeds), args.steps).copy() for i, name in enumerate(SERIES)}
+    for c, name in enumerate(args.controllers):
+        print(f"{name:>12s}: " + " ".join(f"{s}={np.mean(np.sum(series[s][c], axis=-1)):.4g}" for s in SERIES))
+
+    if args.output is not None:
+        np.savez(args.output, controllers=np.array(args.controllers), seeds=np.array(args.seeds), **series)
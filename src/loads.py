@@ -1,3 +1,8 @@
+import csv
+import itertools
+import json
+import os
+
 import numpy as np
 
 class ConstantArrival:
@@ -6,6 +11,9 @@ class ConstantArrival:
         self.duration = duration
     def __call__(self, t):
         return (self.load, self.duration)
+    def schedule(self, times):
+        n = len(times)
+        return (np.ones(n, dtype=np.int64), self.load * np.ones(n), self.duration * np.ones(n))
     def min_values(self):
         return (0, 0)
     def max_values(self):
@@ -18,20 +26,187 @@ class RandomArrival:
         self.p = p
         self.rng = np.random.default_rng(seed)
     def __call__(self, t):
-        if self.rng.rand() < self.p:
+        if self.rng.random() < self.p:
             return (self.load, self.duration)
         else:
             return (0, 0)
+    def schedule(self, times):
+        counts = (self.rng.random(len(times)) < self.p).astype(np.int64)
+        n = np.sum(counts)
+        return (counts, self.load * np.ones(n), self.duration * np.ones(n))
     def min_values(self):
         return (0, 0)
     def max_values(self):
         return (self.load, self.duration)
 
+class PoissonArrival:
+    """
+    Poisson distributed number of jobs per step of length dt, all with the same load and exponentially
+    distributed durations. Returns arrays of (load, duration) so high rates don't need a shorter dt.
+    """
+    def __init__(self, rate, load, duration, dt=1, seed=None):
+        self.rate = rate # Jobs per second
+        self.load = load
+        self.duration = duration # Mean duration
+        self.dt = dt
+        self.rng = np.random.default_rng(seed)
+    def __call__(self, t):
+        n = self.rng.poisson(self.rate * self.dt)
+        return (self.load * np.ones(n), self.rng.exponential(self.duration, n))
+    def schedule(self, times):
+        counts = self.rng.poisson(self.rate * self.dt, len(times))
+        n = np.sum(counts)
+        return (counts, self.load * np.ones(n), self.rng.exponential(self.duration, n))
+    def min_values(self):
+        return (0, 0)
+    def max_values(self):
+        # Observed as total load and mean duration of a step, take a few standard deviations above the mean
+        mean = self.rate * self.dt
+        return (self.load * (mean + 3 * np.sqrt(mean)), 2 * self.duration)
+
+TRACE_COLUMNS = ["submit_time", "power", "duration"]
+
+def convert_trace(source, path, columns=TRACE_COLUMNS, chunk_rows=1000000, index_step=60):
+    """
+    Convert a job log (csv with a header row, or parquet) into the memory mapped format read by TraceArrival,
+    one raw float64 file per column plus a time index, streaming chunk_rows rows at a time. columns names the
+    submit time (s), power (W) and duration (s) columns of the source, which has to be sorted by submit time.
+    index_step is the resolution in seconds of the index that maps a time to its first job.
+    """
+    os.makedirs(path, exist_ok=True)
+    files = [open(os.path.join(path, name + ".bin"), "wb") for name in TRACE_COLUMNS]
+    n_jobs, start, last = 0, None, -np.inf
+    max_power, max_duration = 0.0, 0.0
+    counts = np.zeros(0, dtype=np.int64) # Jobs per index_step bucket
+    try:
+        for chunk in read_chunks(source, columns, chunk_rows):
+            submit_time = chunk[0]
+            if len(submit_time) == 0:
+                continue
+            if submit_time[0] < last or np.any(np.diff(submit_time) < 0):
+                raise ValueError("Trace must be sorted by submit time")
+            last = submit_time[-1]
+            start = submit_time[0] if start is None else start
+
+            bucket = np.bincount(((submit_time - start) // index_step).astype(np.int64))
+            counts = np.pad(counts, (0, max(len(bucket) - len(counts), 0)))
+            counts[:len(bucket)] += bucket
+
+            for f, values in zip(files, chunk):
+                values.astype(np.float64).tofile(f)
+            n_jobs += len(submit_time)
+            max_power = max(max_power, float(np.max(chunk[1])))
+            max_duration = max(max_duration, float(np.max(chunk[2])))
+    finally:
+        for f in files:
+            f.close()
+
+    # index[k] is the first job submitted at or after start + k * index_step
+    np.concatenate([[0], np.cumsum(counts)]).astype(np.int64).tofile(os.path.join(path, "index.bin"))
+    meta = {
+        "n_jobs": n_jobs,
+        "start": 0.0 if start is None else float(start),
+        "index_step": index_step,
+        "max_power": max_power,
+        "max_duration": max_duration,
+        "max_bucket_jobs": int(np.max(counts, initial=0)),
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+def read_chunks(source, columns, chunk_rows):
+    """
+    Yield the columns of source as lists of arrays, chunk_rows rows at a time
+    """
+    if source.endswith(".parquet"):
+        import pyarrow.parquet as pq # Only needed for parquet traces
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows, columns=list(columns)):
+            yield [batch.column(name).to_numpy() for name in columns]
+        return
+    with open(source, newline="") as f:
+        header = next(csv.reader([f.readline()]))
+        usecols = [header.index(name) for name in columns]
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if len(lines) == 0:
+                return
+            yield list(np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2).T)
+
+class TraceArrival:
+    """
+    Jobs replayed from a trace converted with convert_trace. Returns all jobs submitted in [t, t+dt) after
+    start_time in the trace, as arrays of (power, duration). The trace stays on disk as memory maps, only
+    the index (one entry per index_step seconds) is read, so the size of the trace doesn't matter.
+
+    Consecutive steps continue from where the last one ended, any other time (e.g. after a reset) is looked up
+    in the index. Pickling drops the maps so each rllib worker opens the files itself.
+    """
+    def __init__(self, path, start_time=None, dt=1):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.dt = dt
+        self.seek(self.meta["start"] if start_time is None else start_time)
+        self.maps = None
+
+    def open(self):
+        n_jobs = self.meta["n_jobs"]
+        self.maps = {name: np.memmap(os.path.join(self.path, name + ".bin"), dtype=np.float64, mode="r", shape=(n_jobs,)) if n_jobs > 0 else np.zeros(0)
+                     for name in TRACE_COLUMNS}
+        self.index = np.fromfile(os.path.join(self.path, "index.bin"), dtype=np.int64)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["maps"] = None
+        state.pop("index", None)
+        return state
+
+    def seek(self, start_time):
+        """
+        Make env time 0 correspond to start_time in the trace
+        """
+        self.start_time = start_time
+        self.cursor_time = None
+
+    def find(self, trace_time):
+        """
+        Row of the first job submitted at or after trace_time
+        """
+        k = int(np.clip((trace_time - self.meta["start"]) // self.meta["index_step"], 0, len(self.index) - 1))
+        first, last = self.index[k], self.index[min(k + 1, len(self.index) - 1)]
+        return first + int(np.searchsorted(self.maps["submit_time"][first:last], trace_time, "left"))
+
+    def __call__(self, t):
+        if self.maps is None:
+            self.open()
+        trace_time = self.start_time + t
+        first = self.cursor if trace_time == self.cursor_time else self.find(trace_time)
+        last = self.find(trace_time + self.dt)
+        self.cursor, self.cursor_time = last, trace_time + self.dt
+        return (np.array(self.maps["power"][first:last]), np.array(self.maps["duration"][first:last]))
+
+    def schedule(self, times):
+        # Jobs of all the (increasing) times read as one slice, split at the step boundaries
+        if self.maps is None:
+            self.open()
+        boundaries = self.start_time + np.append(times, times[-1] + self.dt)
+        first, last = self.find(boundaries[0]), self.find(boundaries[-1])
+        rows = first + np.searchsorted(self.maps["submit_time"][first:last], boundaries, "left")
+        return (np.diff(rows), np.array(self.maps["power"][first:last]), np.array(self.maps["duration"][first:last]))
+
+    def min_values(self):
+        return (0, 0)
+
+    def max_values(self):
+        # Observed as total load and mean duration of a step, the busiest index bucket spread evenly is a rough guess
+        jobs = max(1, int(np.ceil(self.meta["max_bucket_jobs"] * self.dt / self.meta["index_step"])))
+        return (self.meta["max_power"] * jobs, self.meta["max_duration"])
+
 class ConstantTemperature:
     def __init__(self, temp):
         self.temp = temp
     def __call__(self, t):
-        return self.temp 
+        return np.full(np.shape(t), self.temp)[()]
     def min_values(self):
         return 0
     def max_values(self):
@@ -47,4 +222,24 @@ class SinusTemperature:
     def min_values(self):
         return self.offset - self.amplitude - 1
     def max_values(self):
-        return self.offset + self.amplitude + 1
\ No newline at end of file
+        return self.offset + self.amplitude + 1
+
+class TableTemperature:
+    """
+    Temperature interpolated from measurements, e.g. weather data. times are seconds from the start, repeated
+    every period if set.
+    """
+    def __init__(self, times, temps, period=None):
+        self.times = np.asarray(times, dtype=float)
+        self.temps = np.asarray(temps, dtype=float)
+        self.period = period
+    @classmethod
+    def from_csv(cls, path, time_column="time", temp_column="temp", period=None):
+        data = np.genfromtxt(path, delimiter=",", names=True)
+        return cls(data[time_column], data[temp_column], period)
+    def __call__(self, t):
+        return np.interp(t, self.times, self.temps, period=self.period)
+    def min_values(self):
+        return np.min(self.temps) - 1
+    def max_values(self):
+        return np.max(self.temps) + 1
\ No newline at end of file
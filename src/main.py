@@ -5,7 +5,11 @@ import ray.tune as tune
 from ray.rllib.models import ModelCatalog
 
 import loads 
+import scriptutils
 from dc.dc import DCEnv
+from dc.vecdc import rllib_vec_env
+from dc.sharded import ShardedDCEnv
+from dc.metrics import PLOT_SIGNALS
 from loggerutils.loggingcallbacks import LoggingCallbacks
 
 parser = argparse.ArgumentParser()
@@ -21,16 +25,43 @@ parser.add_argument("--n_servers", type=int, default=40)#360)
 parser.add_argument("--n_racks", type=int, default=1)#12)
 parser.add_argument("--n_crah", type=int, default=1)#4)
 parser.add_argument("--n_place", type=int, default=360) # How many to place load on, mostly for testing
-parser.add_argument("--actions", nargs="+", default=["server", "crah_out", "crah_flow"])
-parser.add_argument("--observations", nargs="+", default=["temp_out", "load", "job"])
+parser.add_argument("--actions", nargs="+", default=["server", "crah_out", "crah_flow"]) # "rack" "slot" is the hierarchical server choice
+parser.add_argument("--placement", type=str, default="least_loaded") # Without a server action, or "first_fit" to pack jobs
+parser.add_argument("--placement_index", action="store_true") # Per rack minimum loads for cheap placement in large fleets
+parser.add_argument("--observations", nargs="+", default=["temp_out", "load", "job"]) # "rack_load" "rack_temp" "candidates" don't grow with n_servers
+parser.add_argument("--load_bins", type=int, default=4) # Bins per rack of "rack_load"
+parser.add_argument("--temp_quantiles", type=int, default=5) # Quantiles per rack of "rack_temp"
+parser.add_argument("--n_candidates", type=int, default=8) # Least loaded servers in "candidates" and choices of the "candidate" action
+parser.add_argument("--control_interval", type=float, default=1) # Seconds between agent actions, a multiple of dt, physics still runs at dt
+parser.add_argument("--fast_forward", action="store_true") # Skip physics ticks without arrivals or completions once settled
+parser.add_argument("--backend", type=str, default="numpy") # "numba" runs the physics as one compiled kernel if numba is installed
+parser.add_argument("--state_dtype", type=str, default="float64") # float32 halves the thermal state, results differ slightly
+parser.add_argument("--flow_model", type=str, default="simple") # "spatial" recirculates per CRAH zone and between neighbouring servers
+parser.add_argument("--individual_crah", action="store_true") # One crah_out/crah_flow setpoint per CRAH instead of a shared one, needs --flow_model spatial
+parser.add_argument("--flatten_observations", action="store_true") # One Box observation instead of a Tuple
 parser.add_argument("--ambient", nargs=2, type=float, default=[20, 0])
+parser.add_argument("--ambient_file", type=str, default=None) # csv with time (s) and temp columns, e.g. weather data, replaces --ambient
+parser.add_argument("--prefetch", type=int, default=10000) # Steps of jobs and ambient temp evaluated at once, 0 evaluates them every step
+parser.add_argument("--arrival_rate", type=float, default=0) # Jobs per second, if set jobs arrive in Poisson batches instead of one per step
+parser.add_argument("--trace", type=str, default=None) # Replay jobs from a trace directory written by loads.convert_trace
+parser.add_argument("--trace_start", type=float, default=None) # Trace time at env time 0, default the first job
 
 # Training settings
 parser.add_argument("--worker_seed", type=int, default=None) # Should make training completely reproducible, but might not work well with multiple workers in PPO
 parser.add_argument("--tag", type=str, default="")
 parser.add_argument("--n_workers", type=int, default=1)
+parser.add_argument("--n_envs", type=int, default=1) # Envs per worker, more than 1 runs them batched in a VecDCEnv
+parser.add_argument("--shards", type=int, default=0) # Split the racks of one env over this many processes, for very large n_servers
 parser.add_argument("--pretrain_timesteps", type=int, default=0)
 parser.add_argument("--stop_timesteps", type=int, default=500000)
+parser.add_argument("--metrics_decimation", type=int, default=1) # Record metrics every n steps
+parser.add_argument("--metrics_path", type=str, default=None) # Write recorded metrics as npz chunks here
+parser.add_argument("--metrics_async", action="store_true") # Evaluate the metrics on a background thread, the step only copies the raw state
+parser.add_argument("--metrics_policy", type=str, default="block") # When the background thread falls behind, "block" waits and "drop" skips steps
+parser.add_argument("--metrics", nargs="+", default=PLOT_SIGNALS) # Signals to record, see dc.metrics, default what visualize.ipynb plots, "all" for every scalar signal
+parser.add_argument("--profile", action="store_true") # Log time and calls per env phase, see dc.profiler
+parser.add_argument("--profile_memory", action="store_true") # With --profile also log peak and allocated memory per phase, slow
+parser.add_argument("--record_path", type=str, default=None) # Stream the full env state to memory mapped files here, read with dc.recorder.TrajectoryReader
 
 args = parser.parse_args()
 
@@ -42,22 +73,24 @@ def trial_name_string(trial):
         name += "_TAG_" + args.tag
     return name
 
-# Job load
-# avg_load = load_per_step / step_len * duration / servers => duration = step_len * avg_load * servers / load_per_step
+# Job load, see scriptutils.load_generator for the duration giving avg_load
 dt = 1
-load_per_step = 20
-duration = dt * args.avg_load * args.n_servers / load_per_step
-load_generator = loads.ConstantArrival(load=load_per_step, duration=duration)
+load_generator = scriptutils.load_generator(args.avg_load, args.n_servers, args.arrival_rate, dt, seed=args.seed)
+if args.trace is not None:
+    load_generator = loads.TraceArrival(args.trace, start_time=args.trace_start, dt=dt)
 
 # Ambient temp
 temp_generator = loads.SinusTemperature(offset=args.ambient[0], amplitude=args.ambient[1])
+if args.ambient_file is not None:
+    temp_generator = loads.TableTemperature.from_csv(args.ambient_file)
 
 # Init ray with all resources
 # needs $ ray start --head --port 6379
 ray.init(address="auto")
 
 # Register env with ray
-ray.tune.register_env("DCEnv", DCEnv)
+assert args.shards == 0 or args.n_envs == 1, "Sharded envs can't be batched"
+ray.tune.register_env("DCEnv", rllib_vec_env if args.n_envs > 1 else ShardedDCEnv if args.shards > 0 else DCEnv)
 
 config = {
     # Environment
@@ -69,13 +102,38 @@ config = {
         "n_racks": args.n_racks,
         "n_crah": args.n_crah,
         "n_place": args.n_place,
+        "num_envs": args.n_envs,
         "load_generator": load_generator,
         "ambient_temp": temp_generator,
         "actions": args.actions,
+        "placement": args.placement,
+        "placement_index": args.placement_index,
         "observations": args.observations,
+        "flatten_observations": args.flatten_observations,
+        "load_bins": args.load_bins,
+        "temp_quantiles": args.temp_quantiles,
+        "n_candidates": args.n_candidates,
+        "shards": args.shards,
+        "flow_model": args.flow_model,
+        "individual_crah": args.individual_crah,
+        "control_interval": args.control_interval,
+        "fast_forward": args.fast_forward,
+        "backend": args.backend,
+        "state_dtype": args.state_dtype,
+        "prefetch": args.prefetch,
         "pretrain_timesteps": args.pretrain_timesteps,
         "crah_out_setpoint": args.crah_out_setpoint,
         "crah_flow_setpoint": args.crah_flow_setpoint,
+        "metrics": {
+            "signals": args.metrics,
+            "decimation": args.metrics_decimation,
+            "path": args.metrics_path,
+            "async": args.metrics_async,
+            **({"policy": args.metrics_policy} if args.metrics_async else {}),
+        },
+        "record_path": args.record_path,
+        "profile": args.profile,
+        "profile_memory": args.profile_memory,
     },
 
     # Model
@@ -88,7 +146,7 @@ config = {
 
     # Worker setup
     "num_workers": args.n_workers, # How many workers are spawned, data is aggregated from all
-    "num_envs_per_worker": 1, # How many envs on a worker, can speed up if on gpu
+    "num_envs_per_worker": 1, # How many envs on a worker, keep at 1 and use --n_envs to batch them in one VecDCEnv
     "num_gpus_per_worker": 0, # Use GPU if you have one
     "num_cpus_per_worker": 1, # Does this make any difference?
     "seed": args.worker_seed,
@@ -0,0 +1,52 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import loads
+
+LOAD_PER_JOB = 20
+
+def load_generator(avg_load, n_servers, arrival_rate=0, dt=1, seed=None):
+    """
+    Job arrivals keeping the servers at avg_load on average, one job per step or Poisson batches of arrival_rate
+    jobs per second. All jobs have load LOAD_PER_JOB, their (mean) duration gives the average load:
+    avg_load = load_per_job * jobs_per_second * duration / servers
+    """
+    if arrival_rate > 0:
+        duration = avg_load * n_servers / (arrival_rate * LOAD_PER_JOB)
+        return loads.PoissonArrival(rate=arrival_rate, load=LOAD_PER_JOB, duration=duration, dt=dt, seed=seed)
+    duration = dt * avg_load * n_servers / LOAD_PER_JOB
+    return loads.ConstantArrival(load=LOAD_PER_JOB, duration=duration)
+
+# The SharedResults array in pool workers, set by attach
+results = None
+shm = None
+
+def attach(name, shape):
+    global results, shm
+    shm = shared_memory.SharedMemory(name=name)
+    results = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+class SharedResults:
+    """
+    NaN filled float64 array in shared memory, the workers of pool() write their results straight into it as
+    scriptutils.results so only small indices go back through the pool. Use as a context manager, the memory
+    is unlinked on exit and array must not be referenced after that.
+    """
+    def __init__(self, shape):
+        self.shape = shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        self.array = np.ndarray(shape, dtype=np.float64, buffer=self.shm.buf)
+        self.array[:] = np.nan
+
+    def pool(self, workers):
+        return mp.Pool(max(workers, 1), initializer=attach, initargs=(self.shm.name, self.shape))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.array = None # The buffer can't be closed while it is exported
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,122 @@
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+import loads
+import scriptutils
+from dc.dc import DCEnv
+from scriptutils import SharedResults
+
+parser = argparse.ArgumentParser(description="Runs heuristic policies over a grid of env configs in a process pool, without ray")
+# Every list argument is a grid axis, all combinations are run
+parser.add_argument("--avg_load", nargs="+", type=float, default=[200])
+parser.add_argument("--arrival_rate", nargs="+", type=float, default=[0]) # 0 is one job per step as in main.py
+parser.add_argument("--ambient_offset", nargs="+", type=float, default=[20])
+parser.add_argument("--ambient_amplitude", nargs="+", type=float, default=[0])
+parser.add_argument("--kR", nargs="+", type=float, default=[3])
+parser.add_argument("--n_servers", nargs="+", type=int, default=[40])
+parser.add_argument("--n_racks", nargs="+", type=int, default=[1])
+parser.add_argument("--n_crah", nargs="+", type=int, default=[1])
+parser.add_argument("--crah_out_setpoint", nargs="+", type=float, default=[22])
+parser.add_argument("--crah_flow_setpoint", nargs="+", type=float, default=[0.8])
+parser.add_argument("--seed", nargs="+", type=int, default=[37])
+parser.add_argument("--policy", nargs="+", default=["least_loaded"])
+# Fixed for the whole sweep
+parser.add_argument("--steps", type=int, default=10000)
+parser.add_argument("--flow_model", type=str, default="simple")
+parser.add_argument("--backend", type=str, default="numpy")
+parser.add_argument("--fast_forward", action="store_true")
+parser.add_argument("--workers", type=int, default=mp.cpu_count())
+parser.add_argument("--output", type=str, default=None) # Write one json line per scenario here
+args = parser.parse_args()
+
+GRID = ["avg_load", "arrival_rate", "ambient_offset", "ambient_amplitude", "kR", "n_servers", "n_racks", "n_crah",
+        "crah_out_setpoint", "crah_flow_setpoint", "seed", "policy"]
+# Aggregated per scenario, one column each in the shared result array
+RESULTS = ["energy", "it_energy", "pue", "dropped_jobs", "overheated_inlets", "reward", "max_temp_cpu", "steps_per_sec"]
+
+def make_env(scenario):
+    """
+    Env and policy for a scenario, the policy maps (env, rng) to an action
+    """
+    dt = 1
+    n_servers = scenario["n_servers"]
+    load_generator = scriptutils.load_generator(scenario["avg_load"], n_servers, scenario["arrival_rate"], dt, seed=scenario["seed"])
+
+    if scenario["policy"] == "least_loaded": # Same as --actions none in main.py
+        actions, policy = ["none"], lambda env, rng: (0,)
+    elif scenario["policy"] == "random":
+        actions, policy = ["server"], lambda env, rng: (rng.integers(env.n_servers),)
+    elif scenario["policy"] == "round_robin":
+        actions, policy = ["server"], lambda env, rng: (int(round(env.time / env.dt)) % env.n_servers,)
+    else:
+        raise ValueError(f"Unknown policy {scenario['policy']}")
+
+    env = DCEnv({
+        "dt": dt,
+        "seed": scenario["seed"],
+        "n_servers": n_servers,
+        "n_racks": scenario["n_racks"],
+        "n_crah": scenario["n_crah"],
+        "kR": scenario["kR"],
+        "load_generator": load_generator,
+        "ambient_temp": loads.SinusTemperature(offset=scenario["ambient_offset"], amplitude=scenario["ambient_amplitude"]),
+        "actions": actions,
+        "crah_out_setpoint": scenario["crah_out_setpoint"],
+        "crah_flow_setpoint": scenario["crah_flow_setpoint"],
+        "flow_model": args.flow_model,
+        "backend": args.backend,
+        "fast_forward": args.fast_forward,
+    })
+    return env, policy
+
+def run(scenario):
+    """
+    Run one scenario and return its RESULTS row
+    """
+    env, policy = make_env(scenario)
+    rng = np.random.default_rng(scenario["seed"])
+    env.reset()
+    energy = it_energy = dropped = overheated = reward = 0.0
+    max_temp_cpu = -np.inf
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        it_energy += np.sum(env.servers.load) * env.dt * env.substeps # Load is constant over the step except for completions
+        _, r, _, _ = env.step(policy(env, rng))
+        # Costs are summed over the ticks of a step, divided by the cost factors they are the physical totals
+        energy += env.total_energy_cost / env.energy_cost
+        dropped += env.total_job_drop_cost / env.job_drop_cost
+        overheated += env.total_overheat_cost / env.overheat_cost
+        reward += r
+        max_temp_cpu = max(max_temp_cpu, np.max(env.servers.temp_cpu))
+    steps_per_sec = args.steps / (time.perf_counter() - start)
+    return [energy, it_energy, (energy + it_energy) / it_energy, dropped, overheated, reward, max_temp_cpu, steps_per_sec]
+
+def work(item):
+    index, scenario = item
+    scriptutils.results[index] = run(scenario)
+    return index
+
+if __name__ == "__main__":
+    scenarios = [dict(zip(GRID, values)) for values in itertools.product(*(getattr(args, name) for name in GRID))]
+    scenarios = [s for s in scenarios if s["n_servers"] % s["n_racks"] == 0]
+
+    # Workers write their row straight into shared memory, only the scenario index goes back through the pool
+    with SharedResults((len(scenarios), len(RESULTS))) as results:
+        start = time.perf_counter()
+        with results.pool(min(args.workers, len(scenarios))) as pool:
+            for done, index in enumerate(pool.imap_unordered(work, enumerate(scenarios)), 1):
+                row = dict(zip(RESULTS, results.array[index].tolist()))
+                print(f"[{done}/{len(scenarios)}] " + " ".join(f"{name}={scenarios[index][name]}" for name in GRID if len(getattr(args, name)) > 1)
+                      + f" pue={row['pue']:.4f} dropped={row['dropped_jobs']:.0f} overheated={row['overheated_inlets']:.0f}")
+        print(f"{len(scenarios)} scenarios x {args.steps} steps in {time.perf_counter() - start:.1f} s")
+        rows = results.array.tolist()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            for scenario, row in zip(scenarios, rows):
+                f.write(json.dumps(dict(scenario, steps=args.steps, **dict(zip(RESULTS, row)))) + "\n")
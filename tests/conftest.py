@@ -0,0 +1,43 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+# The modules are imported from src, the same way main.py runs
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import loads
+
+@pytest.fixture(autouse=True)
+def quiet():
+    # gym and the config fallbacks warn a lot, the tests only compare results
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
+
+@pytest.fixture
+def config():
+    """
+    Config of a small datacenter, every call gets its own arrival generator so envs don't share random state
+    """
+    def make(seed=3, **kwargs):
+        return {
+            "n_servers": 40, "n_racks": 4, "n_crah": 2,
+            "ambient_temp": loads.SinusTemperature(20, 8),
+            "load_generator": loads.PoissonArrival(1, 20, 300, seed=seed),
+            "actions": ["server", "crah_out", "crah_flow"],
+            **kwargs,
+        }
+    return make
+
+@pytest.fixture
+def actions():
+    """
+    Random agent actions matching the config fixture
+    """
+    def make(n, seed=0):
+        rng = np.random.default_rng(seed)
+        return [(np.int64(rng.integers(40)), rng.uniform(-1, 1, 1), rng.uniform(-1, 1, 1)) for _ in range(n)]
+    return make
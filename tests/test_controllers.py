@@ -0,0 +1,30 @@
+import numpy as np
+
+from dc.controllers import FixedSetpoints, PIDCrah, ThresholdPlacement, run_controllers
+from dc.dc import DCEnv
+from dc.vecdc import VecDCEnv
+
+def make_vec(config, seeds):
+    return VecDCEnv(config(num_envs=len(seeds), load_generators=[config(seed=seed)["load_generator"] for seed in seeds]))
+
+def test_fixed_matches_pretraining(config):
+    # FixedSetpoints takes the same actions as DCEnv during pretraining
+    series = run_controllers(make_vec(config, [0, 1]), [FixedSetpoints()] * 2, 100)
+    for seed in [0, 1]:
+        env = DCEnv(config(seed=seed, pretrain_timesteps=100))
+        env.reset()
+        energy = []
+        for _ in range(100):
+            env.step(None)
+            energy.append(env.total_energy_cost / env.energy_cost)
+        assert np.array_equal(series["energy"][seed], energy)
+
+def test_mixed_batch(config):
+    # Controllers sharing a batch act as if each ran alone
+    controllers = [PIDCrah(), ThresholdPlacement(), PIDCrah(), FixedSetpoints()]
+    mixed = run_controllers(make_vec(config, range(4)), controllers, 100)
+    for seed, controller in enumerate(controllers):
+        alone = run_controllers(make_vec(config, [seed]), [type(controller)()], 100)
+        for name in mixed:
+            assert np.array_equal(mixed[name][seed], alone[name][0])
+    assert not np.array_equal(mixed["energy"][0], mixed["energy"][3])
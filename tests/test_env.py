@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+import loads
+from dc.dc import DCEnv
+
+setpoints = (np.zeros(1), np.zeros(1))
+
+@pytest.mark.parametrize("seed", range(3))
+def test_batch_arrivals(config, seed):
+    # Several jobs a step, all placed on different servers since there are fewer than servers
+    env = DCEnv(config(load_generator=loads.PoissonArrival(8, 20, 10000, seed=seed), actions=["crah_out", "crah_flow"]))
+    env.reset()
+    load, duration = env.job
+    assert len(load) > 1
+    assert np.allclose(env.job_state, [np.sum(load), np.mean(duration)])
+    before = env.servers.load.copy()
+    env.step(setpoints)
+    added = env.servers.load - before
+    assert np.isclose(np.sum(added), np.sum(load))
+    assert np.count_nonzero(added) == len(load)
+
+def test_dropped_jobs(config):
+    # A server fits (400 - 50) / 20 = 17 jobs, every later one is dropped
+    env = DCEnv(config(load_generator=loads.ConstantArrival(20, 1000), actions=["server", "crah_out", "crah_flow"]))
+    env.reset()
+    dropped = []
+    for _ in range(20):
+        env.step((np.int64(0),) + setpoints)
+        dropped.append(int(env.servers.dropped_jobs))
+    assert dropped == [0] * 17 + [1] * 3
+    assert env.servers.load[0] == env.servers.max_load - 10
+
+def test_observation_maps(config):
+    # Observations map the env ranges onto -1..1, idle servers sit at the bottom of theirs
+    env = DCEnv(config(observations=["load", "temp_out", "job"]))
+    load, temp_out, job = env.reset()
+    assert np.allclose(load, -1)
+    assert np.allclose(temp_out, (env.flowsim.server_temp_out - 15) / 35 - 1)
+    assert np.all(np.abs(job) <= 1)
+
+def test_flat_observations(config):
+    env = DCEnv(config(flatten_observations=True))
+    first = env.reset()
+    assert first.shape == env.observation_space.shape
+    second = env.step((np.int64(0),) + setpoints)[0]
+    assert not np.shares_memory(first, second)
+
+def test_action_maps(config):
+    env = DCEnv(config())
+    # -1..1 spans the CRAH range and values outside are clipped
+    _, crah_out, crah_flow = env.decode_action((np.int64(3), np.array([-1.0]), np.array([2.0]))).values()
+    assert np.isclose(crah_out, env.crah.min_temp)
+    assert np.isclose(crah_flow, env.crah.max_flow)
+    server, crah_out, _ = env.decode_action((np.int64(3), np.array([0.0]), np.array([0.0]))).values()
+    assert server == 3
+    assert np.isclose(crah_out, (env.crah.min_temp + env.crah.max_temp) / 2)
+
+def test_fast_forward(config):
+    # Sparse jobs and long control intervals, so most ticks are skipped
+    def run(fast_forward):
+        env = DCEnv(config(
+            load_generator=loads.PoissonArrival(0.01, 20, 500, seed=1), actions=["crah_out", "crah_flow"],
+            control_interval=60, fast_forward=fast_forward))
+        env.reset()
+        rewards = [env.step((np.zeros(1), np.array([0.5])))[1] for _ in range(120)]
+        return env, np.array(rewards)
+    full, full_rewards = run(False)
+    skipped, skipped_rewards = run(True)
+    assert full.time == skipped.time == 120 * 60
+    assert np.array_equal(full.servers.load, skipped.servers.load)
+    assert np.allclose(skipped_rewards, full_rewards, rtol=1e-6, atol=0)
+
+@pytest.mark.parametrize("control_interval", [0.4, 1.5])
+def test_control_interval(config, control_interval):
+    with pytest.raises(ValueError):
+        DCEnv(config(control_interval=control_interval))
+
+def test_substeps(config):
+    # Steps of 0.3 with dt 0.1 are three ticks
+    env = DCEnv(config(dt=0.1, control_interval=0.3))
+    env.reset()
+    env.step((np.int64(0),) + setpoints)
+    assert env.substeps == 3
+    assert np.isclose(env.time, 0.3)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from dc.jobs import JobQueue
+
+@pytest.mark.parametrize("heap_size", [0, 20, 1 << 18])
+def test_heap_and_wheel(heap_size):
+    # heap_size 0 starts on the wheel and 20 moves there halfway, all pop the same jobs
+    rng = np.random.default_rng(0)
+    queue, reference = JobQueue(n_slots=16, slot_size=2, heap_size=heap_size), JobQueue(heap_size=1 << 18)
+    target, expected = np.zeros(10), np.zeros(10)
+    step = 0
+    while step < 400:
+        n = rng.integers(0, 4)
+        end, load, placement = step + rng.integers(1, 60, n), rng.uniform(1, 2, n), rng.integers(0, 10, n)
+        for q, t in [(queue, target), (reference, expected)]:
+            q.push(end, load, placement)
+            np.add.at(t, placement, load)
+        step += rng.integers(1, 40) if rng.uniform() < 0.1 else 1 # Jumps like fast_forward
+        retired = queue.pop(step, target)
+        assert sorted(retired.tolist()) == sorted(reference.pop(step, expected).tolist())
+        assert np.allclose(target, expected)
+        assert len(queue) == len(reference)
+        assert queue.next_end() == reference.next_end()
+    restored = JobQueue(n_slots=16, slot_size=2, heap_size=heap_size)
+    restored.set_state(queue.get_state())
+    assert sorted(restored.placements().tolist()) == sorted(reference.placements().tolist())
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import loads
+from dc import kernel
+from dc.dc import DCEnv
+
+@pytest.mark.parametrize("n", [5, 100, 1000, 8192, 8200, 12000, 20000, 100000])
+def test_pairwise_sum(n):
+    # Sizes past numpy's reduction buffer need the blocks np.sum works in
+    block = kernel.sum_block()
+    rng = np.random.default_rng(n)
+    for _ in range(5):
+        a = rng.uniform(0, 50, n) ** 3
+        assert kernel.pairwise_sum(a, 0, n, block) == np.sum(a)
+
+@pytest.mark.parametrize("n_servers, n_racks", [(40, 4), (12000, 100)])
+def test_numba_matches_numpy(config, n_servers, n_racks):
+    pytest.importorskip("numba")
+    def run(backend):
+        env = DCEnv(config(
+            n_servers=n_servers, n_racks=n_racks, load_generator=loads.PoissonArrival(n_servers / 50, 20, 200, seed=1),
+            actions=["crah_out", "crah_flow"], backend=backend))
+        env.reset()
+        rng = np.random.default_rng(0)
+        steps = [env.step((rng.uniform(-1, 1, 1), rng.uniform(-1, 1, 1))) for _ in range(100)]
+        return [np.concatenate(obs) for obs, _, _, _ in steps], [reward for _, reward, _, _ in steps]
+    numpy_obs, numpy_rewards = run("numpy")
+    numba_obs, numba_rewards = run("numba")
+    assert numba_rewards == numpy_rewards
+    assert all(np.array_equal(a, b) for a, b in zip(numpy_obs, numba_obs))
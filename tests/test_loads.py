@@ -0,0 +1,50 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import loads
+
+@pytest.fixture
+def trace(tmp_path):
+    """
+    A converted csv trace with ties, read in several chunks, and its columns
+    """
+    rng = np.random.default_rng(0)
+    n = 5000
+    submit_time = np.sort(rng.uniform(1000, 3000, n))
+    submit_time[100:110] = submit_time[100]
+    power, duration = rng.uniform(5, 50, n), rng.uniform(1, 500, n)
+    with open(tmp_path / "trace.csv", "w") as f:
+        f.write("machine,submit_time,power,duration\n")
+        for row in zip(submit_time, power, duration):
+            f.write("0," + ",".join(repr(float(x)) for x in row) + "\n")
+    loads.convert_trace(str(tmp_path / "trace.csv"), str(tmp_path / "trace"), chunk_rows=700, index_step=60)
+    return str(tmp_path / "trace"), submit_time, power, duration
+
+def test_trace_round_trip(trace):
+    path, submit_time, power, duration = trace
+    arrivals = loads.TraceArrival(path, start_time=1500, dt=2)
+    for t in list(range(0, 600, 2)) + [1000, 10, 1400]: # Consecutive steps, then seeks
+        jobs = (submit_time >= 1500 + t) & (submit_time < 1502 + t)
+        load, length = arrivals(t)
+        assert np.array_equal(load, power[jobs])
+        assert np.array_equal(length, duration[jobs])
+
+def test_trace_schedule(trace):
+    path, submit_time, power, _ = trace
+    counts, load, _ = loads.TraceArrival(path, start_time=1500).schedule(np.arange(100, 200))
+    assert np.array_equal(counts, np.histogram(submit_time, np.arange(1600, 1701))[0])
+    assert np.array_equal(load, power[(submit_time >= 1600) & (submit_time < 1700)])
+
+def test_trace_pickle(trace):
+    path = trace[0]
+    arrivals = loads.TraceArrival(path, start_time=1500)
+    copy = pickle.loads(pickle.dumps(arrivals))
+    assert np.array_equal(copy(10)[0], arrivals(10)[0])
+
+def test_unsorted_trace(tmp_path):
+    with open(tmp_path / "trace.csv", "w") as f:
+        f.write("submit_time,power,duration\n2,1,1\n1,1,1\n")
+    with pytest.raises(ValueError):
+        loads.convert_trace(str(tmp_path / "trace.csv"), str(tmp_path / "trace"))
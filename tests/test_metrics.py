@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.vecdc import VecDCEnv
+
+signals = ["power/compressor", "cost/energy", "job/dropped"]
+
+def run(env, actions):
+    env.reset()
+    for action in actions:
+        env.step(action)
+
+def test_off_by_default(config):
+    assert not DCEnv(config()).metrics.enabled
+
+def test_summary(config, actions):
+    env = DCEnv(config(metrics={"signals": signals}))
+    env.reset()
+    compressor = []
+    for action in actions(50):
+        env.step(action)
+        compressor.append(float(env.crah.compressor_power))
+    summary = env.metrics.summary()
+    assert set(summary) == set(signals) | {"max/" + name for name in signals}
+    assert np.isclose(summary["power/compressor"], np.mean(compressor))
+    assert summary["max/power/compressor"] == np.max(compressor)
+    # Summaries start over
+    env.step(actions(1)[0])
+    assert summary["power/compressor"] != env.metrics.summary()["power/compressor"]
+
+def test_chunks(config, actions, tmp_path):
+    env = DCEnv(config(metrics={"signals": signals + ["srv/load"], "path": str(tmp_path), "capacity": 16, "decimation": 2}))
+    run(env, actions(40))
+    env.close()
+    chunks = [np.load(path) for path in sorted(tmp_path.glob("*.npz"), key=lambda path: path.stat().st_mtime)]
+    time = np.concatenate([chunk["time"] for chunk in chunks])
+    assert np.array_equal(time, np.arange(2, 41, 2))
+    assert np.concatenate([chunk["srv.load"] for chunk in chunks]).shape == (20, env.n_servers)
+
+def async_summary(summary):
+    assert summary.pop("log/dropped_steps") == 0
+    summary.pop("log/wait_time")
+    return summary
+
+def test_async_summary(config, actions):
+    # A small ring so the recorder has to wait for the consumer. The means add up the steps in other batches, so
+    # they only match up to rounding.
+    summaries = []
+    for metrics in [{"signals": ["all"]}, {"signals": ["all"], "async": True, "ring_size": 8, "batch": 3}]:
+        env = DCEnv(config(metrics=metrics))
+        run(env, actions(50))
+        summaries.append(env.metrics.summary())
+        env.close()
+    assert async_summary(summaries[1]) == pytest.approx(summaries[0], rel=1e-12)
+
+def test_async_vec_summary(config, actions):
+    summaries = []
+    for metrics in [{"signals": signals}, {"signals": signals, "async": True}]:
+        env = VecDCEnv(config(num_envs=3, metrics=metrics, load_generators=[config(seed=seed)["load_generator"] for seed in range(3)]))
+        env.vector_reset()
+        for step in actions(30):
+            env.vector_step([step] * 3)
+        summaries.append([view.metrics.summary() for view in env.get_unwrapped()])
+        env.close()
+    assert [async_summary(summary) for summary in summaries[1]] == [pytest.approx(summary, rel=1e-12) for summary in summaries[0]]
+    assert summaries[0][0] != summaries[0][1]
+
+def test_async_chunks(config, actions, tmp_path):
+    chunks = []
+    for name, metrics in [("sync", {}), ("async", {"async": True, "ring_size": 4})]:
+        path = tmp_path / name
+        env = DCEnv(config(metrics={"signals": signals + ["srv/load"], "path": str(path), "capacity": 16, **metrics}))
+        run(env, actions(40))
+        env.close()
+        chunks.append([np.load(chunk) for chunk in sorted(path.glob("*.npz"), key=lambda chunk: chunk.stat().st_mtime)])
+    for name in ["time", "srv.load"] + [signal.replace("/", ".") for signal in signals]:
+        assert np.array_equal(*(np.concatenate([chunk[name] for chunk in run_chunks]) for run_chunks in chunks))
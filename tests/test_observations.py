@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import loads
+from dc.dc import DCEnv
+from dc.vecdc import VecDCEnv
+
+observations = ["rack_load", "rack_temp", "candidates", "job"]
+
+def raw(env, obs):
+    # Observations back in env units
+    return [(o - offset) / scale for o, (_, _, scale, offset) in zip(obs, env.observation_maps)]
+
+def run(env, actions):
+    env.reset()
+    for action in actions:
+        obs, _, _, _ = env.step(action)
+    return obs
+
+def test_shapes(config, actions):
+    env = DCEnv(config(observations=observations, load_bins=3, temp_quantiles=4, n_candidates=5))
+    obs = run(env, actions(50))
+    assert [o.shape for o in obs] == [(4 * 3,), (4 * 4,), (2 * 5,), (2,)]
+    assert all(space.contains(o) for space, o in zip(env.observation_space, obs))
+    # The sizes don't depend on the servers per rack
+    env = DCEnv(config(observations=observations, load_bins=3, temp_quantiles=4, n_candidates=5, n_servers=400))
+    assert [space.shape for space in env.observation_space] == [o.shape for o in obs]
+
+def test_values(config, actions):
+    env = DCEnv(config(observations=observations, load_bins=4, temp_quantiles=3, n_candidates=6))
+    rack_load, rack_temp, candidates, _ = raw(env, run(env, actions(100)))
+    load = env.servers.load.reshape(4, 10)
+    temp = env.flowsim.server_temp_out.reshape(4, 10)
+
+    # Fraction of the rack in every quarter of idle_load..max_load
+    bins = np.clip(((load - 50) / (400 - 50) * 4).astype(int), 0, 3)
+    expected = np.stack([np.bincount(rack, minlength=4) for rack in bins]) / 10
+    assert np.allclose(rack_load.reshape(4, 4), expected)
+    assert np.allclose(rack_temp.reshape(4, 3), np.stack([np.min(temp, axis=1), np.median(temp, axis=1), np.max(temp, axis=1)], axis=1), atol=1e-4)
+
+    # Least loaded first, lowest index on ties
+    order = np.lexsort((np.arange(40), env.servers.load))[:6]
+    assert np.array_equal(env.candidates, order)
+    assert np.allclose(candidates, np.concatenate([env.servers.load[order], env.flowsim.server_temp_out[order]]), atol=1e-4)
+
+def test_candidate_action(config):
+    env = DCEnv(config(observations=["candidates"], actions=["candidate"], load_generator=loads.ConstantArrival(20, 300)))
+    env.reset()
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        candidates = env.candidates.copy()
+        choice = rng.integers(env.n_candidates)
+        load = env.servers.load.copy()
+        env.step((choice,))
+        # The one job of the step goes to the chosen candidate
+        assert np.flatnonzero(env.servers.load != load).tolist() == [candidates[choice]]
+
+@pytest.mark.parametrize("actions_config", [["server", "crah_out", "crah_flow"], ["candidate", "crah_out", "crah_flow"]])
+def test_index_matches_scan(config, actions, actions_config):
+    # DCEnv keeps the histograms and candidates in the placement index, VecDCEnv has none and scans the load
+    n_envs = 2
+    vec = VecDCEnv(config(num_envs=n_envs, observations=observations, actions=actions_config,
+                          load_generators=[config(seed=seed)["load_generator"] for seed in range(n_envs)]))
+    singles = [DCEnv(config(seed=seed, observations=observations, actions=actions_config)) for seed in range(n_envs)]
+    assert vec.servers.index is None and singles[0].servers.index is not None
+    vec_obs = vec.vector_reset()
+    single_obs = [env.reset() for env in singles]
+    steps = [[(step[0] % 8,) + step[1:] for step in actions(100, seed)] for seed in range(n_envs)]
+    for t in range(100):
+        for obs, single in zip(vec_obs, single_obs):
+            assert all(np.array_equal(a, b) for a, b in zip(obs, single))
+        vec_obs, _, _, _ = vec.vector_step([step[t] for step in steps])
+        single_obs = [env.step(step[t])[0] for env, step in zip(singles, steps)]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.observations import rack_histogram
+from dc.placement import PlacementIndex
+from dc.servers import least_loaded
+
+n_racks, servers_per_rack = 12, 10
+
+def random_index(seed, bins=0):
+    # Few distinct loads so there are plenty of ties
+    rng = np.random.default_rng(seed)
+    load = rng.integers(0, 5, n_racks * servers_per_rack).astype(float)
+    index = PlacementIndex(len(load), servers_per_rack, bins, (0, 5))
+    index.build(load)
+    return rng, load, index
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n_jobs", [0, 1, 3, 25, 130])
+def test_least_loaded(seed, n_jobs):
+    _, load, index = random_index(seed)
+    assert np.array_equal(index.least_loaded(n_jobs), least_loaded(load[None], [n_jobs]))
+    # Within racks 3 to 7
+    part = slice(3 * servers_per_rack, 7 * servers_per_rack)
+    assert np.array_equal(index.least_loaded(n_jobs, 3, 7), 3 * servers_per_rack + least_loaded(load[None, part], [n_jobs]))
+
+@pytest.mark.parametrize("n_changed", [1, 5, 30])
+def test_update(n_changed):
+    rng, load, index = random_index(0, bins=4)
+    for _ in range(20):
+        # Jobs starting and finishing, changed in place like Servers.update_jobs does
+        servers = rng.choice(len(load), n_changed, replace=False)
+        load[servers] = np.maximum(load[servers] + rng.integers(-3, 4, n_changed), 0)
+        index.update(servers)
+        racks = load.reshape(n_racks, servers_per_rack)
+        assert np.array_equal(index.rack_min, np.min(racks, axis=1))
+        # On ties the argmin can be any server at the minimum, not necessarily the first
+        assert np.array_equal(index.rack_argmin // servers_per_rack, np.arange(n_racks))
+        assert np.array_equal(load[index.rack_argmin], index.rack_min)
+        assert np.array_equal(index.histogram, rack_histogram(racks, 4, 0, 5))
+        assert np.array_equal(index.least_loaded(7), least_loaded(load[None], [7]))
+
+def first_fit(load, jobs, max_load):
+    # Scanning every server for every job
+    load = load.copy()
+    placement = []
+    for job in jobs:
+        fits = np.flatnonzero(load + job <= max_load)
+        server = fits[0] if len(fits) > 0 else np.argmin(load)
+        load[server] += job
+        placement.append(server)
+    return placement
+
+@pytest.mark.parametrize("seed", range(5))
+def test_first_fit(seed):
+    rng, load, index = random_index(seed)
+    jobs = rng.uniform(0, 3, 200) # Enough that the last ones fit nowhere
+    assert np.array_equal(index.first_fit(jobs, 5), first_fit(load, jobs, 5))
+    part = slice(3 * servers_per_rack, 7 * servers_per_rack)
+    assert np.array_equal(index.first_fit(jobs, 5, 3, 7), 3 * servers_per_rack + np.array(first_fit(load[part], jobs, 5)))
+
+def test_env_index(config, actions):
+    # Placing through the index changes nothing but the speed
+    steps = [step[1:] for step in actions(200)]
+    results = []
+    for placement_index in [False, True]:
+        env = DCEnv(config(placement_index=placement_index, actions=["crah_out", "crah_flow"]))
+        env.reset()
+        results.append([env.step(step)[1] for step in steps])
+        if placement_index:
+            assert np.array_equal(env.servers.index.rack_min, np.min(env.servers.load.reshape(4, -1), axis=1))
+    assert results[0] == results[1]
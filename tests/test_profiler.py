@@ -0,0 +1,59 @@
+import pytest
+
+from dc.dc import DCEnv
+from dc.vecdc import VecDCEnv
+
+def rewards(env, actions):
+    return [env.step(action)[1] for action in actions]
+
+@pytest.mark.parametrize("memory", [False, True])
+def test_profile_same_results(config, actions, memory):
+    steps = actions(100)
+    env = DCEnv(config(profile=True, profile_memory=memory))
+    env.reset()
+    profiled = rewards(env, steps)
+    env = DCEnv(config())
+    env.reset()
+    assert rewards(env, steps) == profiled
+
+def test_summary(config, actions):
+    env = DCEnv(config(profile=True))
+    env.reset()
+    rewards(env, actions(100))
+    summary = env.profiler.summary()
+    assert summary["prof/step_calls"] == 100
+    assert summary["prof/servers.update_calls"] == 100
+    assert 0 < summary["prof/flowsim.step_time"] < summary["prof/step_time"]
+    assert 0 < summary["prof/queue_depth_mean"] <= summary["prof/queue_depth_max"]
+    assert "prof/step_peak_bytes" not in summary
+    # summary starts over
+    assert "prof/step_calls" not in env.profiler.summary()
+
+def test_memory_summary(config, actions):
+    env = DCEnv(config(profile=True, profile_memory=True))
+    env.reset()
+    rewards(env, actions(20))
+    summary = env.profiler.summary()
+    assert summary["prof/step_peak_bytes"] >= summary["prof/servers.update_peak_bytes"] >= 0
+
+def test_vec_profile(config, actions):
+    env = VecDCEnv(config(num_envs=2, profile=True))
+    env.vector_reset()
+    for step in actions(10):
+        env.vector_step([step] * 2)
+    summary = env.profiler.summary()
+    assert summary["prof/vector_step_calls"] == 10
+    assert "prof/step_calls" not in summary
+
+def test_forks_not_profiled(config, actions):
+    steps = actions(20)
+    env = DCEnv(config(profile=True))
+    env.reset()
+    rewards(env, steps[:10])
+    fork = env.fork()
+    assert fork.profiler is None
+    assert type(fork) is DCEnv and type(fork.servers) is not type(env.servers)
+    rewards(fork, steps[10:])
+    assert env.profiler.summary()["prof/step_calls"] == 10
+    # Profiling swapped the classes of env only, a new env is not profiled
+    assert type(DCEnv(config())) is DCEnv
@@ -0,0 +1,24 @@
+import os
+
+import numpy as np
+
+from dc.dc import DCEnv
+from dc.recorder import TrajectoryReader
+
+def test_read_back(config, actions, tmp_path):
+    env = DCEnv(config(record_path=str(tmp_path), record={"chunk_steps": 16}))
+    temp_cpu, costs = [], []
+    for episode in range(2):
+        env.reset()
+        for action in actions(50, seed=episode):
+            env.step(action)
+            temp_cpu.append(env.servers.temp_cpu.copy())
+            costs.append(env.total_energy_cost)
+    env.close()
+
+    reader = TrajectoryReader(os.path.join(tmp_path, f"{os.getpid()}_{env.env_id}"))
+    assert reader.n_steps == 100
+    # Stored as float32, time runs 1..50 in both episodes
+    assert np.array_equal(reader.read("srv/temp_cpu", episode=0), np.float32(temp_cpu[:50]))
+    assert np.array_equal(reader.read("srv/temp_cpu", start_time=11, end_time=21, servers=[0, 5]), np.float32(temp_cpu[60:70])[:, [0, 5]])
+    assert np.array_equal(reader.read("cost/energy"), np.float32(costs[50:]))
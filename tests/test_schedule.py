@@ -0,0 +1,53 @@
+import numpy as np
+
+import loads
+from dc.dc import DCEnv
+from dc.schedule import PrefetchedArrival, PrefetchedTemperature
+
+class EverySeventh:
+    """
+    Two jobs every seventh second, one of them without load
+    """
+    def __call__(self, t):
+        return (np.array([10.0, 0.0]), np.array([t, t])) if t % 7 == 0 else (np.zeros(0), np.zeros(0))
+    def schedule(self, times):
+        busy = times % 7 == 0
+        return 2 * busy, np.tile([10.0, 0.0], np.sum(busy)), np.repeat(times[busy], 2)
+
+def test_prefetched_arrival():
+    generator = EverySeventh()
+    arrivals = PrefetchedArrival(generator, 0.5, block=20)
+    for t in list(np.arange(0, 30, 0.5)) + [100, 7, 3.5]: # Across blocks, then jumps
+        for prefetched, direct in zip(arrivals(t), generator(t)):
+            assert np.array_equal(prefetched, direct)
+    # Steps of 0.5, so the jobs at 14 s are at step 28. The search stops at the end of the block (steps 15 to 34).
+    arrivals.clear()
+    assert arrivals.next_busy_step(15) == 28
+    assert arrivals.next_busy_step(29) == 35
+
+def test_arrival_state():
+    arrivals = PrefetchedArrival(EverySeventh(), 1, block=20)
+    arrivals(3)
+    restored = PrefetchedArrival(EverySeventh(), 1, block=20)
+    restored.set_state(arrivals.get_state())
+    for t in range(3, 23):
+        assert all(np.array_equal(a, b) for a, b in zip(restored(t), arrivals(t)))
+    empty = PrefetchedArrival(EverySeventh(), 1, block=20)
+    restored.set_state(empty.get_state())
+    assert restored.start is None
+
+def test_prefetched_temperature():
+    generator = loads.SinusTemperature(20, 8)
+    temperature = PrefetchedTemperature(generator, 1, block=50)
+    for t in [0, 49, 50, 3, 1000]:
+        assert temperature(t) == generator(t)
+    # Arrays are served from a block unless they span more than one
+    for times in [np.arange(10, 40), np.arange(0, 200, 3.0)]:
+        assert np.array_equal(temperature(times), generator(times))
+
+def test_env_prefetch(config, actions):
+    def run(prefetch):
+        env = DCEnv(config(load_generator=loads.ConstantArrival(20, 300), prefetch=prefetch))
+        env.reset()
+        return [env.step(action)[1] for action in actions(200)]
+    assert run(0) == run(64)
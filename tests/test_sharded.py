@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.sharded import ShardedDCEnv
+
+@pytest.fixture
+def sharded(config):
+    envs = []
+    def make(**kwargs):
+        envs.append(ShardedDCEnv(config(**kwargs)))
+        return envs[-1]
+    yield make
+    for env in envs:
+        env.close()
+
+def rewards(env, actions):
+    env.reset()
+    return np.array([env.step(action)[1] for action in actions])
+
+def test_one_shard_matches(config, actions, sharded):
+    steps = actions(200)
+    assert np.array_equal(rewards(sharded(shards=1), steps), rewards(DCEnv(config()), steps))
+
+def test_shards_match(config, actions, sharded):
+    # Totals are summed per shard, so only rounding differs
+    steps = actions(200)
+    env, single = sharded(shards=3, fast_forward=True, control_interval=5), DCEnv(config(fast_forward=True, control_interval=5))
+    assert np.allclose(rewards(env, steps), rewards(single, steps), rtol=1e-9, atol=0)
+    assert np.array_equal(env.servers.load, single.servers.load)
+
+def test_fork(actions, sharded):
+    steps = actions(100)
+    env = sharded(shards=2)
+    rewards(env, steps[:50])
+    fork = env.fork()
+    try:
+        forked = [fork.step(step)[1] for step in steps[50:]]
+    finally:
+        fork.close()
+    assert [env.step(step)[1] for step in steps[50:]] == forked
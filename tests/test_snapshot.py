@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.jobs import JobQueue
+from dc.vecdc import VecDCEnv
+
+def rewards(env, actions):
+    return [env.step(action)[1] for action in actions]
+
+def test_snapshot_round_trip(config, actions, tmp_path):
+    steps = actions(100)
+    env = DCEnv(config())
+    env.reset()
+    rewards(env, steps[:50])
+    np.savez(tmp_path / "snapshot.npz", **env.get_state_snapshot())
+
+    restored = DCEnv(config(seed=4)) # Arrivals come from the snapshot, not the seed
+    restored.reset()
+    restored.set_state_snapshot(np.load(tmp_path / "snapshot.npz"))
+    assert rewards(restored, steps[50:]) == rewards(env, steps[50:])
+
+def test_snapshot_with_index(config, actions):
+    # Placing through the index, which set_state_snapshot has to rebuild
+    steps = [step[1:] for step in actions(100)]
+    env = DCEnv(config(placement_index=True, actions=["crah_out", "crah_flow"]))
+    env.reset()
+    rewards(env, steps[:50])
+    snapshot = env.get_state_snapshot()
+    expected = rewards(env, steps[50:])
+    env.set_state_snapshot(snapshot)
+    assert rewards(env, steps[50:]) == expected
+
+@pytest.mark.parametrize("heap_size", [2048, 0])
+def test_fork(config, actions, heap_size):
+    steps = actions(100)
+    env = DCEnv(config(fast_forward=True, control_interval=5))
+    env.reset()
+    rewards(env, steps[:50])
+    # Forks copy the queue as it is, on the heap or the wheel
+    queue = JobQueue(heap_size=heap_size)
+    queue.set_state(env.servers.running_jobs.get_state())
+    env.servers.running_jobs = queue
+    fork = env.fork()
+    assert fork.servers.running_jobs is not queue
+    # Stepping the fork leaves the original alone
+    forked = rewards(fork, steps[50:])
+    assert rewards(env, steps[50:]) == forked
+
+def test_vec_fork(config, actions):
+    n_envs = 3
+    env = VecDCEnv(config(num_envs=n_envs, load_generators=[config(seed=seed)["load_generator"] for seed in range(n_envs)]))
+    env.vector_reset()
+    steps = actions(100)
+    for step in steps[:50]:
+        env.vector_step([step] * n_envs)
+    fork = env.fork()
+    forked = [fork.vector_step([step] * n_envs)[1] for step in steps[50:]]
+    assert [env.vector_step([step] * n_envs)[1] for step in steps[50:]] == forked
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.spatialflow import SparseMatrix
+
+def test_sparse_matrix():
+    rng = np.random.default_rng(0)
+    dense = rng.uniform(0, 1, (6, 9)) * (rng.uniform(0, 1, (6, 9)) < 0.4)
+    dense[:, 0] += 1 # Every row needs an entry
+    rows, cols = np.nonzero(dense)
+    matrix = SparseMatrix(rows, cols, dense[rows, cols], dense.shape)
+    assert np.array_equal(matrix.todense(), dense)
+    x = rng.uniform(0, 1, (3, 9))
+    assert np.allclose(matrix.dot(x), x @ dense.T)
+
+def dense_step(flowsim, servers, crah):
+    """
+    SpatialFlow.step on the dense matrices
+    """
+    zones, recirculation = flowsim.zones.todense(), flowsim.recirculation.todense()
+    heat_flow = servers.flow * flowsim.server_temp_out
+    zone_flow = zones @ servers.flow
+    zone_temp = (zones @ heat_flow) / zone_flow
+    zone_recirculation = np.maximum(0, 1 - crah.flow / zone_flow)
+    bypass = np.maximum(0, 1 - zone_flow / crah.flow)
+    recirculated_temp = (recirculation @ heat_flow) / (recirculation @ servers.flow)
+    server_recirculation = np.minimum(1, (zones.T @ zone_recirculation) * flowsim.height)
+    temp_out = flowsim.server_temp_in + servers.delta_t
+    temp_in = (1 - server_recirculation) * (zones.T @ crah.temp_out) + server_recirculation * recirculated_temp
+    crah_temp_in = (1 - bypass) * zone_temp + bypass * crah.temp_out
+    return temp_in, temp_out, crah_temp_in
+
+@pytest.mark.parametrize("crah_flow, recirculates", [(-1.0, True), (1.0, False)])
+def test_matches_dense(config, actions, crah_flow, recirculates):
+    # With 120 servers per CRAH low CRAH flow recirculates, high flow bypasses
+    env = DCEnv(config(n_servers=360, n_racks=12, n_crah=3, flow_model="spatial", individual_crah=True, flow={"reach": 1}))
+    env.reset()
+    rng = np.random.default_rng(0)
+    for (server, _, _) in actions(50):
+        env.step((server, rng.uniform(-1, 1, 3), np.full(3, crah_flow)))
+    assert np.all(env.crah.flow < env.flowsim.zones.dot(env.servers.flow)) == recirculates
+    expected = dense_step(env.flowsim, env.servers, env.crah)
+    env.flowsim.step(env.servers, env.crah)
+    for value, reference in zip((env.flowsim.server_temp_in, env.flowsim.server_temp_out, env.flowsim.crah_temp_in), expected):
+        assert np.allclose(value, reference, rtol=1e-12)
+
+def test_individual_crah_needs_spatial(config):
+    with pytest.raises(ValueError):
+        DCEnv(config(individual_crah=True))
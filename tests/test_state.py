@@ -0,0 +1,58 @@
+import copy
+
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.vecdc import VecDCEnv
+
+def rewards(env, actions):
+    return [env.step(action)[1] for action in actions]
+
+@pytest.mark.parametrize("flow_model", ["simple", "spatial"])
+def test_parts_use_slots(config, flow_model):
+    env = DCEnv(config(flow_model=flow_model))
+    for part in [env.servers, env.crah, env.flowsim]:
+        assert not hasattr(part, "__dict__")
+        with pytest.raises(AttributeError):
+            part.unknown = 1
+
+def test_views_share_buffer(config):
+    env = DCEnv(config())
+    env.reset()
+    servers = env.servers
+    servers.load = 100
+    assert np.all(servers.state["load"] == 100)
+    assert all(np.shares_memory(servers.state, servers.views[name]) for name in servers.state_attributes)
+    # Copies get a buffer of their own
+    other = copy.copy(servers)
+    other.load = 200
+    assert np.all(servers.load == 100) and np.all(other.load == 200)
+    assert other.running_jobs is servers.running_jobs
+
+def test_float32_state(config, actions):
+    steps = actions(200)
+    env = DCEnv(config())
+    env.reset()
+    expected = rewards(env, steps)
+    env32 = DCEnv(config(state_dtype="float32"))
+    env32.reset()
+    # The job and violation counters stay int64
+    for part, part32 in zip([env.servers, env.crah, env.flowsim], [env32.servers, env32.crah, env32.flowsim]):
+        assert part32.state.nbytes < 0.6 * part.state.nbytes
+    assert env32.servers.temp_cpu.dtype == env32.crah.flow.dtype == env32.flowsim.server_temp_in.dtype == np.float32
+    assert np.allclose(rewards(env32, steps), expected, rtol=1e-3)
+
+def test_float32_vec(config, actions):
+    env = VecDCEnv(config(num_envs=2, state_dtype="float32"))
+    env.vector_reset()
+    assert env.servers.load.dtype == np.float32 and env.servers.load.shape == (2, 40)
+    for step in actions(20):
+        env.vector_step([step] * 2)
+    assert env.servers.load.dtype == env.flowsim.server_temp_out.dtype == np.float32
+
+def test_float32_numba_falls_back(config):
+    pytest.importorskip("numba") # Otherwise it falls back for the missing numba
+    with pytest.warns(UserWarning, match="float64"):
+        env = DCEnv(config(state_dtype="float32", backend="numba"))
+    assert env.backend == "numpy"
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from dc.dc import DCEnv
+from dc.vecdc import VecDCEnv
+
+def flat(obs):
+    return np.concatenate([np.ravel(o) for o in obs])
+
+def make_vec(config, n_envs, **kwargs):
+    # One generator per env, seeded like the DCEnv it is compared to
+    return VecDCEnv(config(num_envs=n_envs, load_generators=[config(seed=seed)["load_generator"] for seed in range(n_envs)], **kwargs))
+
+# With pretraining the env reset halfway still takes the default actions after the others stopped
+@pytest.mark.parametrize("pretrain_timesteps", [0, 150])
+def test_matches_single(config, actions, pretrain_timesteps):
+    n_envs = 3
+    vec = make_vec(config, n_envs, pretrain_timesteps=pretrain_timesteps)
+    singles = [DCEnv(config(seed=seed, pretrain_timesteps=pretrain_timesteps)) for seed in range(n_envs)]
+    for obs, env in zip(vec.vector_reset(), singles):
+        assert np.array_equal(flat(obs), flat(env.reset()))
+    steps = [actions(200, seed) for seed in range(n_envs)]
+    for t in range(200):
+        if t == 100:
+            # A single env starting over keeps matching a fresh DCEnv
+            assert np.array_equal(flat(vec.reset_at(1)), flat(singles[1].reset()))
+        vec_obs, vec_rewards, _, _ = vec.vector_step([step[t] for step in steps])
+        for obs, reward, env, step in zip(vec_obs, vec_rewards, singles, steps):
+            single_obs, single_reward, _, _ = env.step(step[t])
+            assert np.array_equal(flat(obs), flat(single_obs))
+            assert reward == single_reward
+
+@pytest.mark.parametrize("option", [{"control_interval": 5}, {"fast_forward": True}, {"backend": "numba"}, {"placement_index": True}])
+def test_single_env_options(config, option):
+    # Options only DCEnv implements warn and fall back
+    with pytest.warns(UserWarning):
+        env = make_vec(config, 2, **option)
+    assert (env.substeps, env.fast_forward, env.backend, env.placement) == (1, False, "numpy", "least_loaded")